@@ -2,62 +2,107 @@ import streamlit as st
 import pandas as pd
 import numpy as np
 import time
-import threading
 import asyncio
+import threading
 from datetime import datetime
+from functools import lru_cache, partial
 import locale
 import random
 
-# Set the event loop policy first
-asyncio.set_event_loop_policy(asyncio.DefaultEventLoopPolicy())
-
-# Create a new event loop and set it as the current loop
-loop = asyncio.new_event_loop()
+# Set the event loop policy first - uvloop when available (POSIX-only),
+# otherwise the stdlib default
+try:
+    import uvloop
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+except ImportError:
+    asyncio.set_event_loop_policy(asyncio.DefaultEventLoopPolicy())
+
+# One loop for the script threads, created once per process. All real IB
+# I/O runs on the dedicated IO loop thread via run_coroutine_threadsafe;
+# this loop exists only because ib_insync's sync helpers expect one to
+# be set. Reruns execute on fresh script threads, so each run re-installs
+# the same loop instead of creating (and abandoning, unclosed) a new one.
+@st.cache_resource(show_spinner=False)
+def _script_loop():
+    return asyncio.new_event_loop()
+
+loop = _script_loop()
 asyncio.set_event_loop(loop)
 
-# Now that we have an event loop, apply nest_asyncio
-import nest_asyncio
-nest_asyncio.apply()
-
 def safe_float_conversion(value_str):
     """Safely convert a string to float, handling various formats"""
     if value_str is None:
         return 0.0
-    
+
+    # Fast path: already a plain number - skip the string machinery.
+    # type() check beats isinstance() here and these two types dominate.
+    if type(value_str) in (int, float):
+        return float(value_str)
+
     # Handle various string formats
     if isinstance(value_str, str):
-        # Remove currency symbols and commas
-        clean_str = value_str.replace(locale.localeconv()['currency_symbol'], '')
-        clean_str = clean_str.replace(',', '')
+        # Remove currency symbols and commas (symbol hoisted to _CURR_SYM
+        # so we don't walk locale state on every call)
+        clean_str = value_str.replace(_CURR_SYM, '').replace(',', '')
         try:
             return float(clean_str)
         except ValueError:
             st.sidebar.warning(f"Could not convert '{value_str}' to float")
             return 0.0
-    
-    # Already a number
+
+    # Anything else (numpy scalars, Decimal, ...)
     try:
         return float(value_str)
     except (ValueError, TypeError):
         return 0.0
 
-# Define the helper function for other threads
 def setup_asyncio_event_loop():
-    """Ensure there is an event loop available for the current thread"""
-    try:
-        loop = asyncio.get_event_loop()
-    except RuntimeError:
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
+    """Ensure the calling thread has an event loop set - ib_insync's
+    sync helpers still expect one on the script thread. Re-installs the
+    shared loop rather than minting a fresh one per thread."""
+    loop = _script_loop()
+    asyncio.set_event_loop(loop)
     return loop
 
 # Now import ib_insync after setting up the asyncio environment
 from ib_insync import *
 
+from scipy.stats import norm
+
+def bs_greeks(stock_price, strikes, t_years, rate, iv, is_call):
+    """Vectorized Black-Scholes delta/gamma across a whole strike grid"""
+    strikes = np.asarray(strikes, dtype=float)
+    iv = np.asarray(iv, dtype=float)
+    sqrt_t = np.sqrt(t_years)
+    d1 = (np.log(stock_price / strikes) + (rate + 0.5 * iv ** 2) * t_years) / (iv * sqrt_t)
+    delta = norm.cdf(d1) if is_call else norm.cdf(d1) - 1
+    gamma = norm.pdf(d1) / (stock_price * iv * sqrt_t)
+    return delta, gamma
+
 
 # Set locale for proper currency formatting
 locale.setlocale(locale.LC_ALL, '')
 
+def _try_float(value):
+    """float(value), or NaN - account summary values arrive as strings"""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+# Cache the currency symbol once - locale.currency() re-reads locale state
+# on every call, which is far too slow for per-cell formatting
+_CURR_SYM = locale.localeconv()['currency_symbol'] or '$'
+
+def fmt_usd(x):
+    """Format a number as currency with a precomputed symbol"""
+    return f"{_CURR_SYM}{x:,.2f}"
+
+@lru_cache(maxsize=1024)
+def _fmt_exp(exp: str) -> str:
+    """Format a 'YYYYMMDD' expiration as 'YYYY-MM-DD' without strptime"""
+    return f"{exp[:4]}-{exp[4:6]}-{exp[6:8]}"
+
 # Initialize the app
 st.set_page_config(
     page_title="IB Portfolio Viewer",
@@ -67,9 +112,72 @@ st.set_page_config(
 )
 
 # Global variables
-stop_event = threading.Event()
 refresh_options = False
 
+# The only account summary tags anything downstream reads - IB returns
+# ~50 tags per request and the rest were parsed into the frame for nothing
+_NEEDED_TAGS = {'NetLiquidation', 'GrossPositionValue', 'TotalCashValue', 'BuyingPower'}
+
+# Live market data subscriptions keyed by conId - kept across refreshes so
+# later refreshes just read the in-place updated Ticker objects instead of
+# re-requesting market data
+_subscribed = {}
+
+# Qualified underlying Stock contracts keyed by symbol - once a contract
+# has its conId it never needs another qualification round-trip
+_qualified_stocks = {}
+
+# Same idea for Option contracts, keyed by (symbol, expiration, strike,
+# right) - the options browser re-fetches the same grid every few seconds
+_qualified_options = {}
+
+def _option(symbol, expiration, strike, right):
+    """Return a cached Option contract, creating it on first use"""
+    key = (symbol, expiration, strike, right)
+    contract = _qualified_options.get(key)
+    if contract is None:
+        contract = Option(symbol, expiration, strike, right, 'SMART')
+        _qualified_options[key] = contract
+    return contract
+
+class RateCoach:
+    """Token-bucket limiter that keeps request bursts under the TWS cap.
+
+    TWS allows ~50 messages per second; a fixed sleep after every request
+    is both too slow on light paths and no guarantee on heavy ones. The
+    coach only waits when the rolling window is actually full.
+    """
+    def __init__(self, time_frame=1.0, call_limit=45):
+        self.time_frame = time_frame
+        self.call_limit = call_limit
+        self._calls = []
+
+    async def wait(self):
+        now = time.monotonic()
+        # Drop calls that have aged out of the rolling window
+        while self._calls and now - self._calls[0] > self.time_frame:
+            self._calls.pop(0)
+        if len(self._calls) >= self.call_limit:
+            # Asynchronous sleep: the only call site is a coroutine on
+            # the IO loop, and blocking there would stall the very loop
+            # that must deliver the ticks awaited right afterwards
+            await asyncio.sleep(self.time_frame - (now - self._calls[0]))
+        self._calls.append(time.monotonic())
+
+coach = RateCoach()
+
+# All IB I/O runs on one asyncio loop owned by a dedicated daemon thread.
+# Streamlit script threads submit coroutines to it and block on the
+# result - a single loop for the ib_insync socket is what the library
+# expects, and nothing tears it down between refreshes.
+@st.cache_resource
+def get_io_loop():
+    io_loop = asyncio.new_event_loop()
+    threading.Thread(target=io_loop.run_forever, daemon=True).start()
+    return io_loop
+
+IO_LOOP = get_io_loop()
+
 # Initialize IB connection
 @st.cache_resource
 def get_ib():
@@ -78,6 +186,11 @@ def get_ib():
 
 ib = get_ib()
 
+# Connection state lives in session state so the status widget renders
+# exactly once per rerun, no matter which code path triggered the connect
+if 'ib_status' not in st.session_state:
+    st.session_state.ib_status = 'disconnected'
+
 # Connect to IB TWS
 def connect_to_ib():
     if not ib.isConnected():
@@ -85,15 +198,20 @@ def connect_to_ib():
              # Use a random client ID to avoid conflicts
             client_id = random.randint(1000, 9999)
             st.sidebar.text(f"Connecting with client ID: {client_id}")
-            
-            # Try to disconnect first in case of lingering connections
-            try:
-                ib.disconnect()
-            except:
-                pass
-            ib.connect('127.0.0.1', 7497, clientId=1)
-            st.success("Connected to Interactive Brokers")
-            
+
+            # Try to disconnect first in case of lingering connections.
+            # Transports are not thread-safe, so the close must run on
+            # the IO loop like every other socket operation here.
+            IO_LOOP.call_soon_threadsafe(ib.disconnect)
+            # Connect on the IO loop so the socket lives where all later
+            # coroutines run
+            run_async(ib.connectAsync('127.0.0.1', 7497, clientId=1))
+            # Set the market data type once per session - it is a stateful
+            # global toggle, not something to flip per contract. It writes
+            # to the socket, so marshal it onto the IO loop too.
+            IO_LOOP.call_soon_threadsafe(ib.reqMarketDataType, 4)  # Delayed frozen data
+            st.session_state.ib_status = 'connected'
+
             # Add diagnostic information
             st.info("Checking account data availability...")
             
@@ -103,7 +221,7 @@ def connect_to_ib():
                 if account_values:
                     st.success(f"Successfully retrieved {len(account_values)} account values")
                     # Display a sample of key values for diagnostics
-                    account_sample = [val for val in account_values if val.tag in ['NetLiquidation', 'GrossPositionValue', 'TotalCashValue']]
+                    account_sample = [val for val in account_values if val.tag in _NEEDED_TAGS]
                     if account_sample:
                         for val in account_sample:
                             st.write(f"{val.tag}: {val.value}")
@@ -128,72 +246,135 @@ def connect_to_ib():
                 
             return True
         except Exception as e:
+            st.session_state.ib_status = 'disconnected'
             st.error(f"Failed to connect to Interactive Brokers: {e}")
             return False
+    st.session_state.ib_status = 'connected'
     return True
 
-# Function to safely run async code
+# Function to safely run async code on the shared IO loop
 def run_async(coro):
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
-    try:
-        return loop.run_until_complete(coro)
-    finally:
-        loop.close()
+    return asyncio.run_coroutine_threadsafe(coro, IO_LOOP).result(timeout=30)
 
 # Async wrapper for portfolio data
 async def async_get_portfolio_data(ib):
-    try:
-        # Debug info
-        st.sidebar.text("Fetching account data...")
-        
-        # Get account summary
-        account_summary = await ib.accountSummaryAsync()
-        
-        if not account_summary:
-            st.sidebar.warning("Account summary is empty")
-            return None, None, None
-            
-        st.sidebar.text(f"Got {len(account_summary)} account values")
-        
-        account_df = pd.DataFrame([(row.tag, row.value) for row in account_summary], 
-                            columns=['Tag', 'Value'])
-        account_df = account_df.set_index('Tag')
-        
-        # Get positions
-        st.sidebar.text("Fetching positions...")
-        positions = await ib.positionsAsync()
-        
-        if not positions:
-            st.sidebar.warning("No positions found")
-            # Return account data even if no positions
-            return account_df, pd.DataFrame(), {}
-            
-        st.sidebar.text(f"Got {len(positions)} positions")
-        
-        # Create a dictionary to store positions by underlying
-        positions_by_underlying = {}
+    # This coroutine runs on the IO loop thread, which has no Streamlit
+    # ScriptRunContext - st.* calls here would render nowhere. Debug and
+    # warning messages are collected and returned for the script-thread
+    # caller to flush.
+    dbg = []
+    warns = []
+    dbg.append("Fetching account data...")
+
+    # Get account summary
+    account_summary = await ib.accountSummaryAsync()
+    
+    if not account_summary:
+        warns.append("Account summary is empty")
+        return None, None, None, None, warns, dbg
         
-        # Process positions
-        st.sidebar.text("Processing positions...")
-        position_count = 0
+    dbg.append(f"Got {len(account_summary)} account values")
+    
+    # Parse numeric values once at ingestion - downstream readers use
+    # the 'Num' column directly instead of re-parsing strings per tick
+    account_df = pd.DataFrame([(row.tag, _try_float(row.value), row.value)
+                               for row in account_summary if row.tag in _NEEDED_TAGS],
+                        columns=['Tag', 'Num', 'Raw'])
+    account_df = account_df.set_index('Tag')
+    
+    # Get positions
+    dbg.append("Fetching positions...")
+    positions = await ib.positionsAsync()
+    
+    if not positions:
+        warns.append("No positions found")
+        # Return account data even if no positions
+        return account_df, pd.DataFrame(), {}, {}, warns, dbg
         
-        for pos in positions:
-            position_count += 1
-            contract = pos.contract
-            underlying_symbol = contract.symbol
-            
-            # Get market price for the underlying
-            if contract.secType == 'STK':
-                underlying_contract = contract
-            else:
-                # For options, get the underlying price
-                underlying_contract = Stock(underlying_symbol, 'SMART', 'USD')
-                await ib.qualifyContractsAsync(underlying_contract)
-            
-            # Use ticker to get real-time price updates
-            ticker = ib.reqMktData(underlying_contract)
-            await asyncio.sleep(0.2)  # Small delay to respect rate limits
+    dbg.append(f"Got {len(positions)} positions")
+    
+    # Create a dictionary to store positions by underlying
+    positions_by_underlying = {}
+
+    # Collect every contract up front so market data can be requested
+    # in one batch instead of one request + sleep per position
+    underlying_by_symbol = {}
+    option_contracts = []
+
+    for pos in positions:
+        contract = pos.contract
+        if contract.secType == 'STK':
+            underlying_by_symbol[contract.symbol] = contract
+        else:
+            # For options, the underlying price comes from a stock contract
+            if contract.symbol not in underlying_by_symbol:
+                if contract.symbol not in _qualified_stocks:
+                    _qualified_stocks[contract.symbol] = Stock(contract.symbol, 'SMART', 'USD')
+                underlying_by_symbol[contract.symbol] = _qualified_stocks[contract.symbol]
+            if contract.secType == 'OPT':
+                option_contracts.append(contract)
+
+    # Qualify everything that still needs a conId in a single round-trip
+    to_qualify = [c for c in underlying_by_symbol.values() if not c.conId]
+    if to_qualify:
+        await ib.qualifyContractsAsync(*to_qualify)
+
+    # Subscribe once per contract; tickers update in place as TWS pushes,
+    # so refreshes after the first read cached state with no new requests
+    all_contracts = list(underlying_by_symbol.values()) + option_contracts
+    # A contract whose qualification failed still has conId 0; keying it
+    # into _subscribed would collide every such contract on 0 and price
+    # one symbol with another's ticker, so drop it and say so
+    unqualified = [c for c in all_contracts if not c.conId]
+    if unqualified:
+        warns.append("Could not qualify, skipping: "
+                     + ", ".join(sorted({c.symbol for c in unqualified})))
+        all_contracts = [c for c in all_contracts if c.conId]
+    new_contracts = [c for c in all_contracts if c.conId not in _subscribed]
+    for c in new_contracts:
+        await coach.wait()
+        _subscribed[c.conId] = ib.reqMktData(c, '', False, False)
+    if new_contracts:
+        # Wait for the first tick on each new subscription rather than
+        # a blind settle sleep - updateEvent fires as soon as data
+        # lands, usually well before the timeout
+        await asyncio.gather(
+            *(asyncio.wait_for(_subscribed[c.conId].updateEvent, timeout=2.0)
+              for c in new_contracts),
+            return_exceptions=True)
+
+    # Drop subscriptions for contracts no longer in the portfolio
+    active_conids = {c.conId for c in all_contracts}
+    for conid in list(_subscribed):
+        if conid not in active_conids:
+            ib.cancelMktData(_subscribed.pop(conid).contract)
+
+    tickers_by_conid = {conid: _subscribed[conid] for conid in active_conids}
+    underlying_tickers = {c.symbol: tickers_by_conid.get(c.conId)
+                          for c in underlying_by_symbol.values()}
+
+    # Process positions
+    dbg.append("Processing positions...")
+    position_count = 0
+
+    # One flat row per position - aggregation happens in a single
+    # vectorized groupby pass after the loop
+    position_rows = []
+
+    # Resolve each underlying price once per refresh - several positions
+    # typically share the same underlying
+    price_by_symbol = {}
+
+    for pos in positions:
+        position_count += 1
+        contract = pos.contract
+        underlying_symbol = contract.symbol
+
+        if underlying_symbol in price_by_symbol:
+            underlying_price = price_by_symbol[underlying_symbol]
+        else:
+            # Read the underlying price from the live ticker
+            ticker = underlying_tickers[underlying_symbol]
             underlying_price = ticker.marketPrice()
             if underlying_price is None or underlying_price <= 0:
                 # Try last price
@@ -205,271 +386,327 @@ async def async_get_portfolio_data(ib):
                         # Use average cost as last resort
                         if contract.secType == 'STK':
                             underlying_price = pos.avgCost
-                            st.sidebar.warning(f"No market price for {underlying_symbol}, using avg cost: {underlying_price}")
+                            warns.append(f"No market price for {underlying_symbol}, using avg cost: {underlying_price}")
                         else:
                             # For options without price data, set a placeholder
-                            st.sidebar.warning(f"No price data for {underlying_symbol}, using 100 as placeholder")
+                            warns.append(f"No price data for {underlying_symbol}, using 100 as placeholder")
                             underlying_price = 100  # Arbitrary placeholder
+            price_by_symbol[underlying_symbol] = underlying_price
 
-            if position_count <= 2:  # Show debug for first couple positions only
-                st.sidebar.text(f"Position {position_count}: {underlying_symbol} @ {underlying_price}")
-            
-            if underlying_symbol not in positions_by_underlying:
-                positions_by_underlying[underlying_symbol] = {
-                    'stock_count': 0,
-                    'stock_value': 0,
-                    'option_notional': 0,
-                    'option_actual_value': 0,
-                    'underlying_price': underlying_price
-                }
+        if position_count <= 2:  # Show debug for first couple positions only
+            dbg.append(f"Position {position_count}: {underlying_symbol} @ {underlying_price}")
+
+        delta = 0.0
+        option_price = 0.0
+
+        if contract.secType == 'OPT':
+            # Get option data from the batched snapshot
+            option_ticker = tickers_by_conid[contract.conId]
+
+            # Calculate option delta (if available, otherwise use approximation)
+            delta = None
+            option_price = option_ticker.marketPrice()
             
-            # Calculate position values
-            if contract.secType == 'STK':
-                positions_by_underlying[underlying_symbol]['stock_count'] += pos.position
-                positions_by_underlying[underlying_symbol]['stock_value'] += pos.position * underlying_price
-            elif contract.secType == 'OPT':
-                # Get option data
-                option_ticker = ib.reqMktData(contract)
-                await asyncio.sleep(0.2)  # Small delay to respect rate limits
-                
-                # Calculate option delta (if available, otherwise use approximation)
-                delta = None
-                option_price = option_ticker.marketPrice()
-                
-                if hasattr(option_ticker, 'modelGreeks') and option_ticker.modelGreeks:
+            if hasattr(option_ticker, 'modelGreeks') and option_ticker.modelGreeks:
+                delta = option_ticker.modelGreeks.delta
+            else:
+                # Greeks often arrive a moment after the snapshot -
+                # wait on the ticker's own update event with a short
+                # timeout instead of polling on a fixed sleep.
+                # (Market data type is set once at connect time.)
+                try:
+                    await asyncio.wait_for(option_ticker.updateEvent, timeout=0.5)
+                except asyncio.TimeoutError:
+                    pass
+                if option_ticker.modelGreeks:
                     delta = option_ticker.modelGreeks.delta
-                else:
-                    # Request option computation
-                    await ib.reqMarketDataTypeAsync(4)  # Switch to delayed frozen data
-                    try:
-                        await ib.calculateImpliedVolatilityAsync(contract, option_price, underlying_price)
-                        await asyncio.sleep(0.2)
-                        await ib.calculateOptionPriceAsync(contract, option_ticker.impliedVolatility, underlying_price)
-                        await asyncio.sleep(0.2)
-                        
-                        # Try again to get delta
-                        if hasattr(option_ticker, 'modelGreeks') and option_ticker.modelGreeks:
-                            delta = option_ticker.modelGreeks.delta
-                    except Exception as option_error:
-                        st.sidebar.text(f"Option calculation error: {option_error}")
-                    
-                    # Fallback delta calculation if still None
-                    if delta is None:
-                        if contract.right == 'C':  # Call option
-                            delta = 0.7 if underlying_price > contract.strike else 0.3
-                        else:  # Put option
-                            delta = -0.7 if underlying_price < contract.strike else -0.3
-                
-                # Use absolute value of delta for notional calculation
-                abs_delta = abs(delta)
-                option_multiplier = 100
-                option_notional = abs_delta * option_multiplier * pos.position
-                positions_by_underlying[underlying_symbol]['option_notional'] += option_notional
-                
-                # Calculate actual option value
-                option_value = option_price * option_multiplier * abs(pos.position)
-                positions_by_underlying[underlying_symbol]['option_actual_value'] += option_value
-        
-        st.sidebar.text("Creating dataframe...")
-        
-        # Create DataFrame for display
-        underlying_data = []
-        total_npv = 0
-        
-        for symbol, data in positions_by_underlying.items():
-            stock_notional = data['stock_count'] * data['underlying_price']
-            option_notional = data['option_notional'] * data['underlying_price']
-            total_notional = stock_notional + option_notional
-            
-            underlying_data.append({
-                'Symbol': symbol,
-                'Stock Count': data['stock_count'],
-                'Stock Value': data['stock_value'],
-                'Option Notional (Shares)': data['option_notional'] / 100,  # Convert to contract equivalents
-                'Option Notional Value': option_notional,
-                'Option Actual Value': data['option_actual_value'],
-                'Underlying Price': data['underlying_price'],
-                'Notional Position Value (NPV)': total_notional
-            })
-            
-            total_npv += total_notional
-        
-        underlying_df = pd.DataFrame(underlying_data)
-        st.sidebar.text(f"Created dataframe with {len(underlying_df)} rows")
-        
-        # Calculate portfolio metrics
-        st.sidebar.text("Calculating metrics...")
-        try:
-            nlv = safe_float_conversion(account_df.loc['NetLiquidation', 'Value'])
-            gross_pos_val = safe_float_conversion(account_df.loc['GrossPositionValue', 'Value'])
-            
-            # Calculate notional leverage ratio
-            notional_leverage_ratio = total_npv / nlv if nlv > 0 else 0
-            standard_leverage_ratio = gross_pos_val / nlv if nlv > 0 else 0
-            
-            # Add NGAV and NLR to account summary
-            account_df.loc['NGAV (Notional Gross Asset Value)', 'Value'] = locale.currency(total_npv, grouping=True)
-            account_df.loc['NLR (Notional Leverage Ratio)', 'Value'] = f"{notional_leverage_ratio:.2f}"
-            account_df.loc['Standard Leverage Ratio', 'Value'] = f"{standard_leverage_ratio:.2f}"
-            
-            st.sidebar.text("Metrics calculated successfully")
-        except Exception as metrics_error:
-            st.sidebar.error(f"Error calculating metrics: {metrics_error}")
-            # Handle case where account data doesn't have the expected fields
-            pass
-        
-        st.sidebar.text("Portfolio data retrieval complete")
-        return account_df, underlying_df, positions_by_underlying
-        
-    except Exception as e:
-        st.sidebar.error(f"Error in portfolio data retrieval: {str(e)}")
-        import traceback
-        st.sidebar.text(traceback.format_exc())
-        return None, None, None
+
+                # Fallback delta calculation if still None
+                if delta is None:
+                    if contract.right == 'C':  # Call option
+                        delta = 0.7 if underlying_price > contract.strike else 0.3
+                    else:  # Put option
+                        delta = -0.7 if underlying_price < contract.strike else -0.3
+
+        position_rows.append((underlying_symbol, contract.secType, pos.position,
+                              underlying_price, delta, option_price))
+
+    dbg.append("Creating dataframe...")
+
+    # Aggregate per underlying in one C-level pass instead of mutating
+    # a dict of accumulators per position
+    pos_df = pd.DataFrame(position_rows,
+                          columns=['symbol', 'secType', 'position', 'price', 'delta', 'opt_price'])
+    is_stk = pos_df['secType'] == 'STK'
+    is_opt = pos_df['secType'] == 'OPT'
+    option_multiplier = 100
+    pos_df['stock_count'] = np.where(is_stk, pos_df['position'], 0.0)
+    pos_df['stock_value'] = pos_df['stock_count'] * pos_df['price']
+    pos_df['option_notional'] = np.where(is_opt, pos_df['delta'].abs() * option_multiplier * pos_df['position'], 0.0)
+    pos_df['option_actual_value'] = np.where(is_opt, pos_df['opt_price'] * option_multiplier * pos_df['position'].abs(), 0.0)
+
+    agg = pos_df.groupby('symbol', sort=False).agg(
+        stock_count=('stock_count', 'sum'),
+        stock_value=('stock_value', 'sum'),
+        option_notional=('option_notional', 'sum'),
+        option_actual_value=('option_actual_value', 'sum'),
+        underlying_price=('price', 'first'))
+
+    positions_by_underlying = agg.to_dict('index')
+
+    # Build the display frame from the aggregated numpy columns
+    symbols = list(agg.index)
+    stock_count = agg['stock_count'].to_numpy()
+    stock_value = agg['stock_value'].to_numpy()
+    option_notional = agg['option_notional'].to_numpy()
+    option_actual_value = agg['option_actual_value'].to_numpy()
+    underlying_price = agg['underlying_price'].to_numpy()
+
+    stock_notional = stock_count * underlying_price
+    option_notional_value = option_notional * underlying_price
+    total_notional = stock_notional + option_notional_value
+    total_npv = float(total_notional.sum())
+
+    underlying_df = pd.DataFrame({
+        'Symbol': symbols,
+        'Stock Count': stock_count,
+        'Stock Value': stock_value,
+        'Option Notional (Shares)': option_notional / 100,  # Convert to contract equivalents
+        'Option Notional Value': option_notional_value,
+        'Option Actual Value': option_actual_value,
+        'Underlying Price': underlying_price,
+        'Notional Position Value (NPV)': total_notional
+    })
+    dbg.append(f"Created dataframe with {len(underlying_df)} rows")
+    
+    # Calculate portfolio metrics - the raw floats travel in this dict
+    # so the render path never parses them back out of the frame
+    dbg.append("Calculating metrics...")
+    metrics = {}
+    try:
+        nlv = account_df.at['NetLiquidation', 'Num']
+        gross_pos_val = account_df.at['GrossPositionValue', 'Num']
+        
+        # Calculate notional leverage ratio
+        notional_leverage_ratio = total_npv / nlv if nlv > 0 else 0
+        standard_leverage_ratio = gross_pos_val / nlv if nlv > 0 else 0
+        
+        # Add NGAV and NLR to account summary - keep the raw float
+        # around so the render path never parses a formatted string.
+        # Appended as one concat rather than three .loc inserts, each
+        # of which reindexes and copies the frame.
+        extras = pd.DataFrame(
+            {'Num': [total_npv, notional_leverage_ratio, standard_leverage_ratio],
+             'Raw': [fmt_usd(total_npv), f"{notional_leverage_ratio:.2f}", f"{standard_leverage_ratio:.2f}"]},
+            index=['NGAV (Notional Gross Asset Value)',
+                   'NLR (Notional Leverage Ratio)',
+                   'Standard Leverage Ratio'])
+        account_df = pd.concat([account_df, extras])
+
+        metrics = {
+            'nlv': nlv,
+            'gross_pos_val': gross_pos_val,
+            'ngav': total_npv,
+            'nlr': notional_leverage_ratio,
+            'std_leverage': standard_leverage_ratio,
+        }
+
+
+        dbg.append("Metrics calculated successfully")
+    except Exception as metrics_error:
+        warns.append(f"Error calculating metrics: {metrics_error}")
+        # Handle case where account data doesn't have the expected fields
+        pass
+    
+    dbg.append("Portfolio data retrieval complete")
+
+    return account_df, underlying_df, positions_by_underlying, metrics, warns, dbg
+
+
+# Cached option chain definitions - these change at most daily, so there
+# is no reason to re-fetch them on every refresh cycle. A plain module
+# dict rather than st.cache_data: this is awaited inside coroutines that
+# already run on the IO loop, where a sync run_async call would block
+# the loop on work the loop itself must execute (a deadlock), and where
+# Streamlit's cache machinery has no script context anyway.
+_chain_cache = {}
+_CHAIN_TTL = 3600.0
+
+async def get_chain_definition(ib, symbol):
+    """Fetch and cache the SMART option chain definition for a symbol"""
+    cached = _chain_cache.get(symbol)
+    if cached is not None and time.monotonic() - cached[0] < _CHAIN_TTL:
+        return cached[1]
+    stock = await _qualified_stock(ib, symbol)
+    chains = await ib.reqSecDefOptParamsAsync(stock.symbol, '', stock.secType, stock.conId)
+    chain = next((c for c in chains if c.exchange == 'SMART'), None)
+    if not chain:
+        definition = (stock.conId, (), ())
+    else:
+        definition = (stock.conId, tuple(sorted(chain.expirations)), tuple(sorted(chain.strikes)))
+    _chain_cache[symbol] = (time.monotonic(), definition)
+    return definition
+
+async def _qualified_stock(ib, symbol):
+    """Return the cached Stock contract for symbol, qualifying once"""
+    stock = _qualified_stocks.get(symbol)
+    if stock is None:
+        stock = Stock(symbol, 'SMART', 'USD')
+        _qualified_stocks[symbol] = stock
+    if not stock.conId:
+        await ib.qualifyContractsAsync(stock)
+    return stock
 
 # Async wrapper for option chain data
 async def async_get_option_chain(ib, ticker):
     # Get the stock contract
-    stock = Stock(ticker, 'SMART', 'USD')
-    await ib.qualifyContractsAsync(stock)
-    
+    stock = await _qualified_stock(ib, ticker)
+
     # Get current stock price
-    ticker = ib.reqMktData(stock)
-    await asyncio.sleep(0.2)
-    stock_price = ticker.marketPrice()
-    
-    # Get the option chains
-    chains = await ib.reqSecDefOptParamsAsync(stock.symbol, '', stock.secType, stock.conId)
-    
-    # Get all expiration dates
-    expirations = []
-    for chain in chains:
-        if chain.exchange == 'SMART':
-            expirations = sorted(chain.expirations)
-            break
-    
+    (stock_ticker,) = await ib.reqTickersAsync(stock)
+    stock_price = stock_ticker.marketPrice()
+
+    # Get all expiration dates from the cached chain definition
+    _, expirations, _ = await get_chain_definition(ib, ticker)
+
     # Return all data needed
-    return stock_price, expirations
+    return stock_price, list(expirations)
 
 # Async wrapper for options data
 async def async_get_options_for_expiration(ib, ticker, expiration):
     # Get the stock contract
-    stock = Stock(ticker, 'SMART', 'USD')
-    await ib.qualifyContractsAsync(stock)
-    
+    stock = await _qualified_stock(ib, ticker)
+
     # Get current stock price
-    ticker_data = ib.reqMktData(stock)
-    await asyncio.sleep(0.2)
-    stock_price = ticker_data.marketPrice()
-    
-    # Get option chain for selected expiration
-    chains = await ib.reqSecDefOptParamsAsync(stock.symbol, '', stock.secType, stock.conId)
-    
-    # Find the SMART exchange chain
-    chain = next((c for c in chains if c.exchange == 'SMART'), None)
-    if not chain:
+    (stock_ticker,) = await ib.reqTickersAsync(stock)
+    stock_price = stock_ticker.marketPrice()
+
+    # Get all strike prices from the cached chain definition
+    _, _, strikes = await get_chain_definition(ib, ticker)
+    if not strikes:
         return None, None, None
+    strikes = list(strikes)
     
-    # Get all strike prices
-    strikes = sorted(chain.strikes)
-    
-    # Create call and put options
-    calls = []
-    puts = []
-    
-    # Request data for each strike
-    for strike in strikes:
-        call_contract = Option(ticker, expiration, strike, 'C', 'SMART')
-        put_contract = Option(ticker, expiration, strike, 'P', 'SMART')
-        
-        await ib.qualifyContractsAsync(call_contract, put_contract)
-        
-        # Request market data for call
-        call_ticker = ib.reqMktData(call_contract)
-        await asyncio.sleep(0.1)  # Small delay to respect rate limits
-        
-        # Request market data for put
-        put_ticker = ib.reqMktData(put_contract)
-        await asyncio.sleep(0.1)  # Small delay
-        
-        # Get data for call
-        call_price = call_ticker.marketPrice()
-        call_bid = call_ticker.bid
-        call_ask = call_ticker.ask
-        call_last = call_ticker.last
-        
-        # Try to get delta and gamma for call
-        call_delta = None
-        call_gamma = None
-        
-        if hasattr(call_ticker, 'modelGreeks') and call_ticker.modelGreeks:
-            call_delta = call_ticker.modelGreeks.delta
-            call_gamma = call_ticker.modelGreeks.gamma
-        else:
-            # Use approximation
-            call_delta = 0.7 if stock_price > strike else 0.3
-            call_gamma = 0.01  # Default gamma
-        
-        # Similarly for put
-        put_price = put_ticker.marketPrice()
-        put_bid = put_ticker.bid
-        put_ask = put_ticker.ask
-        put_last = put_ticker.last
-        
-        put_delta = None
-        put_gamma = None
-        
-        if hasattr(put_ticker, 'modelGreeks') and put_ticker.modelGreeks:
-            put_delta = put_ticker.modelGreeks.delta
-            put_gamma = put_ticker.modelGreeks.gamma
-        else:
-            # Use approximation
-            put_delta = -0.7 if stock_price < strike else -0.3
-            put_gamma = 0.01  # Default gamma
-        
-        # Calculate percentage of stock price
-        call_pct = (call_price / stock_price) * 100 if stock_price > 0 else 0
-        put_pct = (put_price / stock_price) * 100 if stock_price > 0 else 0
-        
-        # Calculate difference from stock price
-        call_diff = call_price - (stock_price - strike) if stock_price > strike else call_price
-        put_diff = put_price - (strike - stock_price) if stock_price < strike else put_price
-        
-        calls.append({
-            'Strike': strike,
-            'Bid': call_bid,
-            'Ask': call_ask,
-            'Last': call_last,
-            'Price': call_price,
-            'Delta': call_delta,
-            'Gamma': call_gamma,
-            'Pct of Stock': f"{call_pct:.2f}%",
-            'Diff from Stock': call_diff
-        })
-        
-        puts.append({
-            'Strike': strike,
-            'Bid': put_bid,
-            'Ask': put_ask,
-            'Last': put_last,
-            'Price': put_price,
-            'Delta': put_delta,
-            'Gamma': put_gamma,
-            'Pct of Stock': f"{put_pct:.2f}%",
-            'Diff from Stock': put_diff
-        })
-    
-    return stock_price, calls, puts
-
-# Non-async wrapper functions for threading
+    # Build every contract before any network call so qualification and
+    # market data each take a single batched round-trip. Contracts come
+    # from the module cache, so only never-seen ones need qualification.
+    # Bind the fields shared by the whole grid once; each per-strike call
+    # passes only what varies
+    _mk = partial(_option, ticker, expiration)
+    call_contracts = [_mk(strike, 'C') for strike in strikes]
+    put_contracts = [_mk(strike, 'P') for strike in strikes]
+
+    to_qualify = [c for c in call_contracts + put_contracts if not c.conId]
+    if to_qualify:
+        await ib.qualifyContractsAsync(*to_qualify)
+
+    # One snapshot request for every call and put across all strikes
+    tickers = await ib.reqTickersAsync(*call_contracts, *put_contracts)
+    call_tickers = tickers[:len(strikes)]
+    put_tickers = tickers[len(strikes):]
+
+    # Greeks can trail the snapshot - give the stragglers one bounded
+    # batched wait, then fall back to the closed-form approximation.
+    # Never per-contract server-side IV/price recalculation round-trips.
+    missing_greeks = [t for t in tickers if not t.modelGreeks]
+    if missing_greeks:
+        await asyncio.gather(
+            *(asyncio.wait_for(t.updateEvent, timeout=1.0) for t in missing_greeks),
+            return_exceptions=True)
+
+    # Precompute Black-Scholes greeks for the whole grid in one vectorized
+    # pass - used as the fallback when TWS has not populated modelGreeks,
+    # instead of paying two more server round-trips per contract
+    expiry = datetime.strptime(expiration, '%Y%m%d')
+    t_years = max((expiry - datetime.now()).days, 1) / 365.0
+    call_iv = np.array([t.impliedVolatility if getattr(t, 'impliedVolatility', None) else 0.3
+                        for t in call_tickers])
+    put_iv = np.array([t.impliedVolatility if getattr(t, 'impliedVolatility', None) else 0.3
+                       for t in put_tickers])
+    bs_call_delta, bs_call_gamma = bs_greeks(stock_price, strikes, t_years, 0.05, call_iv, True)
+    bs_put_delta, bs_put_gamma = bs_greeks(stock_price, strikes, t_years, 0.05, put_iv, False)
+
+    # Harvest ticker fields into preallocated columns - the frames are
+    # built once from whole arrays instead of a dict per strike, so
+    # pandas never re-infers dtypes row by row
+    n = len(strikes)
+    strikes_arr = np.asarray(strikes, dtype=float)
+    call_bid = np.empty(n); call_ask = np.empty(n); call_last = np.empty(n)
+    put_bid = np.empty(n); put_ask = np.empty(n); put_last = np.empty(n)
+    call_delta = np.empty(n); call_gamma = np.empty(n)
+    put_delta = np.empty(n); put_gamma = np.empty(n)
+    call_px = np.empty(n); put_px = np.empty(n)
+
+    for i in range(n):
+        ct = call_tickers[i]
+        call_px[i] = ct.marketPrice()
+        call_bid[i] = ct.bid
+        call_ask[i] = ct.ask
+        call_last[i] = ct.last
+        greeks = ct.modelGreeks
+        call_delta[i] = greeks.delta if greeks else bs_call_delta[i]
+        call_gamma[i] = greeks.gamma if greeks else bs_call_gamma[i]
+
+        pt = put_tickers[i]
+        put_px[i] = pt.marketPrice()
+        put_bid[i] = pt.bid
+        put_ask[i] = pt.ask
+        put_last[i] = pt.last
+        greeks = pt.modelGreeks
+        put_delta[i] = greeks.delta if greeks else bs_put_delta[i]
+        put_gamma[i] = greeks.gamma if greeks else bs_put_gamma[i]
+
+    # Derived per-strike columns computed in one vectorized pass instead
+    # of ~10 scalar Python ops per strike inside the loop
+    inv_s = 100.0 / stock_price if stock_price > 0 else 0.0
+    call_pct = call_px * inv_s
+    put_pct = put_px * inv_s
+    call_diff = np.where(stock_price > strikes_arr, call_px - (stock_price - strikes_arr), call_px)
+    put_diff = np.where(stock_price < strikes_arr, put_px - (strikes_arr - stock_price), put_px)
+
+    calls_df = pd.DataFrame({
+        'Strike': strikes_arr,
+        'Bid': call_bid,
+        'Ask': call_ask,
+        'Last': call_last,
+        'Price': call_px,
+        'Delta': call_delta,
+        'Gamma': call_gamma,
+        'Pct of Stock': np.char.mod('%.2f%%', call_pct),
+        'Diff from Stock': call_diff
+    }, copy=False)
+
+    puts_df = pd.DataFrame({
+        'Strike': strikes_arr,
+        'Bid': put_bid,
+        'Ask': put_ask,
+        'Last': put_last,
+        'Price': put_px,
+        'Delta': put_delta,
+        'Gamma': put_gamma,
+        'Pct of Stock': np.char.mod('%.2f%%', put_pct),
+        'Diff from Stock': put_diff
+    }, copy=False)
+
+    return stock_price, calls_df, puts_df
+
+# Non-async wrapper functions for the Streamlit script thread
 def get_portfolio_data():
     if not ib.isConnected():
-        return None, None, None
+        return None, None, None, None
     try:
-        return run_async(async_get_portfolio_data(ib))
+        account_df, underlying_df, positions_by_underlying, metrics, warns, dbg = \
+            run_async(async_get_portfolio_data(ib))
+        # Single flush from the script thread: one warning widget and,
+        # when debugging, one text block instead of a write per step
+        if warns:
+            st.sidebar.warning("\n".join(warns))
+        if dbg and st.session_state.get('debug'):
+            st.sidebar.text("\n".join(dbg))
+        return account_df, underlying_df, positions_by_underlying, metrics
     except Exception as e:
         st.error(f"Error getting portfolio data: {e}")
-        return None, None, None
+        return None, None, None, None
 
 def get_option_chain(ticker):
     if not ib.isConnected():
@@ -497,31 +734,20 @@ st.sidebar.title("IB Connection Status")
 connection_status = st.sidebar.empty()
 
 if not ib.isConnected():
+    st.session_state.ib_status = 'disconnected'
     if st.sidebar.button("Connect to TWS"):
         connect_to_ib()
 
-# Update connection status
-if ib.isConnected():
+# Single status render per rerun, driven by session state
+if st.session_state.ib_status == 'connected':
     connection_status.success("Connected to TWS")
 else:
     connection_status.error("Not connected to TWS")
 
-# Portfolio-wide metrics section (always visible)
-st.header("Portfolio Metrics")
-portfolio_metrics = st.empty()
-
-# Main content area
-main_content = st.container()
-
-# Options Browser
-st.header("Options Browser")
-search_col, expiry_col = st.columns([1, 3])
-with search_col:
-    ticker_input = st.text_input("Enter Ticker Symbol", "")
-    search_button = st.button("Search Options")
-
-expiration_container = expiry_col.empty()
-options_display = st.empty()
+# The portfolio and options sections are drawn entirely inside their
+# refresh fragments (see render_portfolio/render_options below): a
+# fragment may not write widgets into containers created outside it,
+# and external placeholders are cleared on every fragment rerun.
 
 # Data refresh control
 refresh_rate = st.sidebar.slider("Portfolio Refresh Rate (seconds)", 5, 30, 15)
@@ -577,165 +803,130 @@ if st.sidebar.button("Test API Data Access"):
                 st.error(f"Error getting positions: {e}")
 
 if st.sidebar.button("Direct Portfolio Fetch"):
-    st.sidebar.info("Directly fetching portfolio data (bypassing threading)...")
-    
-# Function to update portfolio data in background
-def update_portfolio_data():
-    # Set up event loop for this thread
-    setup_asyncio_event_loop()
+    st.sidebar.info("Directly fetching portfolio data...")
     
-    while not stop_event.is_set():
-        if ib.isConnected():
-            account_df, underlying_df, _ = get_portfolio_data()
-            
-            if account_df is not None and underlying_df is not None:
-                # Update portfolio metrics display
-                with portfolio_metrics.container():
-                    # Create a nice grid layout for the metrics
-                    metrics_cols = st.columns(6)
-                    
-                    # Extract key metrics
-                    try:
-                        nlv = float(account_df.loc['NetLiquidation', 'Value'])
-                        gross_pos_val = float(account_df.loc['GrossPositionValue', 'Value'])
-                        ngav = safe_float_conversion(account_df.loc['NGAV (Notional Gross Asset Value)', 'Value'])
-                        nlr = float(account_df.loc['NLR (Notional Leverage Ratio)', 'Value'])
-                        std_leverage = float(account_df.loc['Standard Leverage Ratio', 'Value'])
-                        
-                        metrics_cols[0].metric("Net Liquidation Value", 
-                                             locale.currency(nlv, grouping=True))
-                        metrics_cols[1].metric("Gross Position Value", 
-                                             locale.currency(gross_pos_val, grouping=True))
-                        metrics_cols[2].metric("NGAV", 
-                                             locale.currency(ngav, grouping=True))
-                        metrics_cols[3].metric("Standard Leverage", 
-                                             f"{std_leverage:.2f}x")
-                        metrics_cols[4].metric("Notional Leverage Ratio", 
-                                             f"{nlr:.2f}x")
-                        metrics_cols[5].metric("Buying Power", 
-                                             account_df.loc['BuyingPower', 'Value'] 
-                                             if 'BuyingPower' in account_df.index else "N/A")
-                    except Exception as e:
-                        st.error(f"Error updating metrics: {e}")
-                
-                # Update underlying positions table
-                with main_content:
-                    st.subheader("Positions by Underlying")
-                    # Format monetary values
-                    for col in ['Stock Value', 'Option Notional Value', 'Option Actual Value', 'Notional Position Value (NPV)']:
-                        if col in underlying_df.columns:
-                            underlying_df[col] = underlying_df[col].apply(lambda x: locale.currency(x, grouping=True))
-                    
-                    # Format underlying price
-                    if 'Underlying Price' in underlying_df.columns:
-                        underlying_df['Underlying Price'] = underlying_df['Underlying Price'].apply(lambda x: f"${x:.2f}")
-                    
-                    st.dataframe(underlying_df, use_container_width=True)
-                    
-                    # Show last update time
-                    st.caption(f"Last updated: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-        
-        # Sleep until next update
-        time.sleep(refresh_rate)
+# Cache the snapshot across sessions for one refresh interval - extra
+# browser tabs share a single TWS round-trip bundle. The key is a cheap
+# local positions signature, so the cache only busts when positions change
+# or the ttl expires.
+@st.cache_data(ttl=refresh_rate, show_spinner=False)
+def portfolio_snapshot(positions_sig):
+    return get_portfolio_data()
+
+# Fragment that refreshes the portfolio section - Streamlit drives the
+# rerun on the main thread instead of a background Python thread, and
+# the fragment owns every element it draws
+@st.fragment(run_every=refresh_rate)
+def render_portfolio():
+    if not ib.isConnected():
+        return
 
-# Function to update options data in background
-def update_options_data():
-    # Set up event loop for this thread
-    setup_asyncio_event_loop()
-    
-    current_ticker = ""
-    current_expiration = ""
-    
-    while not stop_event.is_set():
-        if ib.isConnected() and ticker_input and search_button:
-            ticker = ticker_input
-            
-            # Only fetch new data if ticker changed or forced refresh
-            if ticker != current_ticker or refresh_options:
-                current_ticker = ticker
-                # Get option chain data
-                stock_price, expirations = get_option_chain(ticker)
-                
-                if stock_price is not None and expirations:
-                    # Display expiration selection
-                    with expiration_container.container():
-                        # Format expirations for display
-                        exp_dates = [datetime.strptime(exp, '%Y%m%d').strftime('%Y-%m-%d') for exp in expirations]
-                        selected_exp_index = st.select_slider(
-                            "Select Expiration Date",
-                            options=range(len(exp_dates)),
-                            format_func=lambda i: exp_dates[i]
-                        )
-                        selected_exp = expirations[selected_exp_index]
-                    
-                    # Get options data for selected expiration
-                    if selected_exp != current_expiration:
-                        current_expiration = selected_exp
-                        stock_price, calls, puts = get_options_for_expiration(ticker, selected_exp)
-                        
-                        if stock_price is not None and calls and puts:
-                            # Display options data
-                            with options_display.container():
-                                st.subheader(f"{ticker} Options - Stock Price: ${stock_price:.2f}")
-                                
-                                # Create DataFrame for calls and puts
-                                calls_df = pd.DataFrame(calls)
-                                puts_df = pd.DataFrame(puts)
-                                
-                                # Display tables side by side with strike in the middle
-                                cols = st.columns([4, 2, 4])
-                                
-                                # Display calls on the left
-                                with cols[0]:
-                                    st.subheader("CALLS")
-                                    call_display_cols = ['Bid', 'Ask', 'Last', 'Price', 'Delta', 'Gamma', 'Pct of Stock', 'Diff from Stock']
-                                    st.dataframe(calls_df[call_display_cols], use_container_width=True)
-                                
-                                # Display strikes in the middle
-                                with cols[1]:
-                                    st.subheader("Strike")
-                                    st.dataframe(calls_df[['Strike']], use_container_width=True)
-                                
-                                # Display puts on the right
-                                with cols[2]:
-                                    st.subheader("PUTS")
-                                    put_display_cols = ['Bid', 'Ask', 'Last', 'Price', 'Delta', 'Gamma', 'Pct of Stock', 'Diff from Stock']
-                                    st.dataframe(puts_df[put_display_cols], use_container_width=True)
-                                
-                                # Show last update time
-                                st.caption(f"Last updated: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-        
-        # Sleep until next update
-        time.sleep(options_refresh_rate)
+    positions_sig = tuple(sorted((p.contract.conId, p.position) for p in ib.positions()))
+    account_df, underlying_df, _, metrics = portfolio_snapshot(positions_sig)
+
+    if account_df is None or underlying_df is None:
+        return
 
-# Start background threads
+    # No change-detection skip here: a fragment rerun replaces the
+    # fragment's previous output, so returning early on an unchanged
+    # snapshot would blank the section rather than keep it
+
+    # Metrics grid - key metrics come pre-parsed from the producer
+    metrics_cols = st.columns(6)
+    try:
+        nlv = metrics['nlv']
+        gross_pos_val = metrics['gross_pos_val']
+        ngav = metrics['ngav']
+        nlr = metrics['nlr']
+        std_leverage = metrics['std_leverage']
+
+        metrics_cols[0].metric("Net Liquidation Value", fmt_usd(nlv))
+        metrics_cols[1].metric("Gross Position Value", fmt_usd(gross_pos_val))
+        metrics_cols[2].metric("NGAV", fmt_usd(ngav))
+        metrics_cols[3].metric("Standard Leverage", f"{std_leverage:.2f}x")
+        metrics_cols[4].metric("Notional Leverage Ratio", f"{nlr:.2f}x")
+        metrics_cols[5].metric("Buying Power",
+                               account_df.at['BuyingPower', 'Raw']
+                               if 'BuyingPower' in account_df.index else "N/A")
+    except Exception as e:
+        st.error(f"Error updating metrics: {e}")
+
+    # Underlying positions table - columns stay numeric (sortable,
+    # compact Arrow payload) and the frontend does the currency
+    # formatting
+    st.subheader("Positions by Underlying")
+    money_cols = ['Stock Value', 'Option Notional Value', 'Option Actual Value', 'Notional Position Value (NPV)']
+    column_config = {col: st.column_config.NumberColumn(format="$%.2f")
+                     for col in money_cols if col in underlying_df.columns}
+    if 'Underlying Price' in underlying_df.columns:
+        column_config['Underlying Price'] = st.column_config.NumberColumn(format="$%.2f")
+
+    st.dataframe(underlying_df, use_container_width=True, hide_index=True,
+                 column_config=column_config)
+
+    # Show last update time
+    st.caption(f"Last updated: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+
+# Fragment that refreshes the options section
+@st.fragment(run_every=options_refresh_rate)
+def render_options():
+    ticker = st.session_state.get('ticker_input', '')
+    if not (ib.isConnected() and ticker):
+        return
+
+    # Get option chain data
+    stock_price, expirations = get_option_chain(ticker)
+
+    if stock_price is None or not expirations:
+        return
+
+    # Expiration selector - created inside the fragment, since widgets
+    # written to outside containers raise from a fragment
+    exp_dates = [_fmt_exp(exp) for exp in expirations]
+    selected_exp_index = st.select_slider(
+        "Select Expiration Date",
+        options=range(len(exp_dates)),
+        format_func=lambda i: exp_dates[i]
+    )
+    selected_exp = expirations[selected_exp_index]
+
+    # Get options data for selected expiration - the producer already
+    # returns column-oriented DataFrames
+    stock_price, calls_df, puts_df = get_options_for_expiration(ticker, selected_exp)
+
+    if stock_price is not None and calls_df is not None and not calls_df.empty:
+        st.subheader(f"{ticker} Options - Stock Price: ${stock_price:.2f}")
+
+        # Join into one frame with the strike in the middle - a single
+        # Arrow serialization instead of three side-by-side tables
+        options_df = (calls_df.drop(columns=['Strike']).add_prefix('Call ')
+                      .join(calls_df[['Strike']])
+                      .join(puts_df.drop(columns=['Strike']).add_prefix('Put ')))
+
+        st.dataframe(options_df, use_container_width=True, hide_index=True,
+                     column_config={'Strike': st.column_config.NumberColumn(format='%.2f')})
+
+        # Show last update time
+        st.caption(f"Last updated: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+
+# Run the refresh fragments
 def main():
     # Set up event loop for the main thread
     setup_asyncio_event_loop()
-    
-    if connect_to_ib():
-        # Create and start portfolio update thread
-        portfolio_thread = threading.Thread(target=update_portfolio_data)
-        portfolio_thread.daemon = True
-        portfolio_thread.start()
-        
-        # Create and start options update thread
-        options_thread = threading.Thread(target=update_options_data)
-        options_thread.daemon = True
-        options_thread.start()
-        
-        # Keep main thread alive
-        try:
-            while True:
-                time.sleep(1)
-        except KeyboardInterrupt:
-            # Signal threads to stop
-            stop_event.set()
-            # Disconnect from IB
-            if ib.isConnected():
-                ib.disconnect()
-    else:
+
+    if not connect_to_ib():
         st.error("Failed to connect to Interactive Brokers. Please make sure TWS or IB Gateway is running.")
+        return
+
+    # Page layout in order; each fragment renders at its call site and
+    # Streamlit reruns it on its own schedule - no background threads or
+    # keep-alive loop needed
+    st.header("Portfolio Metrics")
+    render_portfolio()
+
+    st.header("Options Browser")
+    st.text_input("Enter Ticker Symbol", "", key="ticker_input")
+    render_options()
 
 # Handle Streamlit's odd execution model
 if __name__ == "__main__":
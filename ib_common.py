@@ -0,0 +1,94 @@
+"""
+Shared helpers for the Streamlit IB test scripts.
+
+The test scripts grew as near-copies of each other; the pieces that are
+genuinely identical - event-loop setup, the batched account/positions
+fetch and the frame builders - live here so they are byte-compiled once
+and fixed in one place instead of three.
+"""
+import asyncio
+
+import pandas as pd
+import streamlit as st
+
+
+@st.cache_resource(show_spinner=False)
+def _shared_loop():
+    """One event loop per process. The IB socket binds to the loop that
+    created it, so handing out a fresh loop per Streamlit rerun would
+    strand the cached connection on a loop nobody runs any more."""
+    try:
+        import uvloop
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    except ImportError:
+        asyncio.set_event_loop_policy(asyncio.DefaultEventLoopPolicy())
+    return asyncio.new_event_loop()
+
+
+def setup_event_loop():
+    """Install the shared loop on the calling thread and return it.
+
+    uvloop's libuv-based loop drains the many small per-tick callbacks
+    on the IB socket with far less Python-level bookkeeping; it is
+    POSIX-only, so the stdlib default is the fallback. Streamlit reruns
+    execute on new script threads, so each rerun must re-install the
+    same loop rather than build its own.
+    """
+    loop = _shared_loop()
+    asyncio.set_event_loop(loop)
+    return loop
+
+
+# Fetch account summary and positions concurrently - the requests are
+# independent, so overlapping them costs one round-trip instead of two.
+# Any contracts passed in are qualified in the same gather, hiding that
+# round-trip under the account fetch.
+def fetch_all(ib, *contracts):
+    if not ib or not ib.isConnected():
+        st.error("Not connected to IB")
+        return (None,) * (3 if contracts else 2)
+
+    try:
+        st.info("Requesting account summary and positions...")
+        coros = [ib.accountSummaryAsync(), ib.reqPositionsAsync()]
+        if contracts:
+            coros.append(ib.qualifyContractsAsync(*contracts))
+        return tuple(ib.run(asyncio.gather(*coros)))
+    except Exception as e:
+        st.error(f"Error fetching account data: {e}")
+        return (None,) * (3 if contracts else 2)
+
+
+# Build the account summary frame from pre-fetched values
+def get_account_info(account_values):
+    if account_values:
+        st.success(f"Received {len(account_values)} account values")
+        # Column-oriented construction: pandas takes the fast dict-of-lists
+        # path instead of transposing a list of row tuples
+        df = pd.DataFrame({
+            'Tag': [val.tag for val in account_values],
+            'Value': [val.value for val in account_values],
+            'Currency': [val.currency for val in account_values],
+        })
+        return df
+    else:
+        st.warning("No account data received")
+        return None
+
+
+# Build the positions frame from pre-fetched positions
+def get_positions(positions):
+    if positions:
+        st.success(f"Received {len(positions)} positions")
+        # Build column lists directly rather than one dict per row, so
+        # each column arrives with a uniform dtype and no re-inference
+        return pd.DataFrame({
+            'Symbol': [pos.contract.symbol for pos in positions],
+            'SecType': [pos.contract.secType for pos in positions],
+            'Exchange': [pos.contract.exchange for pos in positions],
+            'Position': [pos.position for pos in positions],
+            'Avg Cost': [pos.avgCost for pos in positions],
+        })
+    else:
+        st.warning("No positions received")
+        return None
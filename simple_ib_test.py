@@ -3,19 +3,21 @@ Simplified Interactive Brokers connection test for Streamlit.
 Save this as 'simple_ib_test.py' and run with 'streamlit run simple_ib_test.py'
 """
 import streamlit as st
-import pandas as pd
+import pyarrow as pa
 import asyncio
 import random
 import time
 from datetime import datetime
 
-# Set up asyncio properly
-asyncio.set_event_loop_policy(asyncio.DefaultEventLoopPolicy())
-loop = asyncio.new_event_loop()
-asyncio.set_event_loop(loop)
+# Set up asyncio before ib_insync is imported; shared with the other
+# test scripts via ib_common
+from ib_common import setup_event_loop, fetch_all, get_account_info, get_positions
 
-# Now import ib_insync
-from ib_insync import *
+loop = setup_event_loop()
+
+# Import only the two names this script uses - `import *` binds ~80 and
+# module import time dominates Streamlit cold start
+from ib_insync import IB, Stock
 
 # Initialize the app
 st.set_page_config(
@@ -26,72 +28,29 @@ st.set_page_config(
 
 st.title("Interactive Brokers Simple Connection Test")
 
+# One IB connection per process: cache_resource is shared across all
+# browser sessions and reruns, so multiple tabs stop burning Gateway
+# client-id slots and only the first caller pays the handshake
+@st.cache_resource
+def get_ib(client_id, readonly):
+    ib = IB()
+    ib.connect('127.0.0.1', 7497, clientId=client_id, readonly=readonly)
+    return ib
+
 # Basic connection function
 def connect_to_ib(client_id=None, readonly=True):
     if client_id is None:
         client_id = random.randint(1000, 9999)
     
-    ib = IB()
     try:
         st.info(f"Connecting with client ID: {client_id}...")
-        ib.connect('127.0.0.1', 7497, clientId=client_id, readonly=readonly)
+        ib = get_ib(client_id, readonly)
         st.success(f"Connected to IB Gateway with client ID {client_id}")
         return ib
     except Exception as e:
         st.error(f"Connection failed: {e}")
         return None
 
-# Get account info synchronously
-def get_account_info(ib):
-    if not ib or not ib.isConnected():
-        st.error("Not connected to IB")
-        return None
-    
-    try:
-        st.info("Requesting account summary...")
-        account_values = ib.accountSummary()
-        
-        if account_values:
-            st.success(f"Received {len(account_values)} account values")
-            df = pd.DataFrame([(val.tag, val.value, val.currency) for val in account_values], 
-                              columns=['Tag', 'Value', 'Currency'])
-            return df
-        else:
-            st.warning("No account data received")
-            return None
-    except Exception as e:
-        st.error(f"Error getting account info: {e}")
-        return None
-
-# Get positions synchronously
-def get_positions(ib):
-    if not ib or not ib.isConnected():
-        st.error("Not connected to IB")
-        return None
-    
-    try:
-        st.info("Requesting positions...")
-        positions = ib.positions()
-        
-        if positions:
-            st.success(f"Received {len(positions)} positions")
-            pos_data = []
-            for pos in positions:
-                pos_data.append({
-                    'Symbol': pos.contract.symbol,
-                    'SecType': pos.contract.secType,
-                    'Exchange': pos.contract.exchange,
-                    'Position': pos.position,
-                    'Avg Cost': pos.avgCost
-                })
-            return pd.DataFrame(pos_data)
-        else:
-            st.warning("No positions received")
-            return None
-    except Exception as e:
-        st.error(f"Error getting positions: {e}")
-        return None
-
 # UI for testing connection
 st.subheader("Connection Settings")
 col1, col2 = st.columns(2)
@@ -100,8 +59,16 @@ with col1:
 with col2:
     readonly = st.checkbox("Read-only mode", value=True)
 
+st.sidebar.checkbox("Debug mode", key="debug")
+
 if st.button("Connect to IB Gateway"):
-    ib = connect_to_ib(client_id=client_id, readonly=readonly)
+    # Reuse the live session on reruns - every widget interaction
+    # re-executes this script, and a fresh IB() per click pays the full
+    # TCP handshake again
+    if 'ib' in st.session_state and st.session_state.ib.isConnected():
+        ib = st.session_state.ib
+    else:
+        ib = connect_to_ib(client_id=client_id, readonly=readonly)
     
     if ib and ib.isConnected():
         st.session_state.ib = ib
@@ -112,18 +79,40 @@ if st.button("Connect to IB Gateway"):
         server_time = ib.reqCurrentTime()
         st.write(f"Connection Time: {server_time}")
         
-        # Request market data type
-        ib.reqMarketDataType(1)  # Use real-time data
+        # Pin the market data type once per session - it is a global
+        # session toggle, so repeating it on every rerun is a wasted
+        # round-trip
+        if st.session_state.get('mdt_set') != 1:
+            ib.reqMarketDataType(1)  # Use real-time data
+            st.session_state.mdt_set = 1
+        
+        # Fetch account info and positions in one overlapped round-trip;
+        # the first run also qualifies the test contract under the same
+        # gather so the market data block finds it ready
+        if 'aapl_contract' in st.session_state:
+            account_values, positions = fetch_all(ib)
+        else:
+            account_values, positions, qualified = fetch_all(ib, Stock('AAPL', 'SMART', 'USD'))
+            if qualified:
+                st.session_state.aapl_contract = qualified[0]
         
-        # Get account info
         st.subheader("Account Summary")
-        account_df = get_account_info(ib)
+        account_df = get_account_info(account_values)
         if account_df is not None:
-            st.dataframe(account_df)
+            # st.dataframe re-serializes a pandas frame to Arrow IPC on
+            # every rerun; keep the Arrow table around and reuse it while
+            # the underlying account values are unchanged
+            key = hash(tuple((v.tag, v.value) for v in account_values))
+            if st.session_state.get('acct_key') == key:
+                tbl = st.session_state.acct_tbl
+            else:
+                tbl = pa.Table.from_pandas(account_df)
+                st.session_state.acct_key = key
+                st.session_state.acct_tbl = tbl
+            st.dataframe(tbl, use_container_width=True)
         
-        # Get positions
         st.subheader("Positions")
-        positions_df = get_positions(ib)
+        positions_df = get_positions(positions)
         if positions_df is not None:
             st.dataframe(positions_df)
         
@@ -138,9 +127,15 @@ if st.button("Connect to IB Gateway"):
             
             # Function to handle ticker updates
             def on_ticker_update(ticker):
-                # Store the updated ticker data in session state
+                # IB resends unchanged quotes; skip the dict rebuild (and
+                # the JSON push it feeds) when nothing moved
+                tick = (ticker.last, ticker.bid, ticker.ask)
+                if tick == st.session_state.get('_last_tick'):
+                    return
+                st.session_state._last_tick = tick
+                mp = ticker.marketPrice()  # derives from bid/ask/last; compute once
                 st.session_state.ticker_data = {
-                    'Market Price': ticker.marketPrice(),
+                    'Market Price': mp,
                     'Last': ticker.last,
                     'Bid': ticker.bid,
                     'Ask': ticker.ask,
@@ -150,77 +145,108 @@ if st.button("Connect to IB Gateway"):
                     'Has Data': ticker.last is not None or ticker.bid is not None or ticker.ask is not None
                 }
             
-            # Create contract and qualify it
-            stock = Stock('AAPL', 'SMART', 'USD')
-            ib.qualifyContracts(stock)
-            
-            # Try alternative methods
-            st.text("Method 1: Using reqMktData with events")
+            # Normally already qualified during fetch_all; this is only a
+            # fallback if that gather failed
+            if 'aapl_contract' not in st.session_state:
+                stock = Stock('AAPL', 'SMART', 'USD')
+                ib.qualifyContracts(stock)
+                st.session_state.aapl_contract = stock
+            stock = st.session_state.aapl_contract
             
-            # Request market data and register event handler
-            ticker = ib.reqMktData(stock, '', False, False)
-            ticker.updateEvent += on_ticker_update
-            
-            # Wait with progress bar
-            progress_bar = st.progress(0)
             data_display = st.empty()
             
-            for i in range(20):
-                progress_bar.progress((i+1)/20)
-                
-                # Show the current state of the data
-                if st.session_state.ticker_data:
-                    data_display.json(st.session_state.ticker_data)
-                    
-                    # If we have actual data, break early
-                    if st.session_state.ticker_data.get('Has Data'):
-                        break
-                else:
-                    data_display.text("Waiting for ticker data...")
-                    
-                # Allow events to process
-                ib.sleep(0.5)
-            
-            # If first method failed, try method 2
-            if not st.session_state.ticker_data or not st.session_state.ticker_data.get('Has Data'):
-                st.text("Method 1 failed. Trying Method 2: Using reqTickers")
-                ib.cancelMktData(stock)  # Cancel the previous request
-                
-                # Try using reqTickers instead
-                tickers = ib.reqTickers(stock)
-                if tickers:
-                    st.session_state.ticker_data = {
-                        'Market Price': tickers[0].marketPrice(),
-                        'Last': tickers[0].last,
-                        'Bid': tickers[0].bid,
-                        'Ask': tickers[0].ask,
-                        'Method': 'reqTickers'
-                    }
-                    data_display.json(st.session_state.ticker_data)
+            # Race the three acquisition methods instead of chaining them,
+            # so worst-case latency is the slowest single method rather
+            # than the sum of all three. Each coroutine returns a data
+            # dict on success or None on failure/timeout.
+            async def snapshot_method():
+                try:
+                    tickers = await asyncio.wait_for(ib.reqTickersAsync(stock), timeout=2)
+                except asyncio.TimeoutError:
+                    return None
+                if not tickers:
+                    return None
+                t = tickers[0]
+                if t.last is None and t.bid is None and t.ask is None:
+                    return None
+                return {
+                    'Market Price': t.marketPrice(),
+                    'Last': t.last,
+                    'Bid': t.bid,
+                    'Ask': t.ask,
+                    'Close': t.close,
+                    'Volume': t.volume,
+                    'Has Data': True,
+                    'Method': 'reqTickers'
+                }
             
-            # If second method also failed, try method 3
-            if not st.session_state.ticker_data or not st.session_state.ticker_data.get('Has Data'):
-                st.text("Method 2 failed. Trying Method 3: Manual market snapshot")
+            async def streaming_method():
+                t = ib.reqMktData(stock, '', False, False)
+                t.updateEvent += on_ticker_update
+                fut = asyncio.get_event_loop().create_future()
                 
-                # Try one more approach - get a complete market snapshot
-                contract = Stock('AAPL', 'SMART', 'USD')
-                contract.exchange = 'SMART'
-                ib.qualifyContracts(contract)
+                def _first_tick(tk):
+                    if (tk.last or tk.bid or tk.ask) and not fut.done():
+                        fut.set_result(tk)
                 
-                # Request a complete market snapshot
-                ticker = ib.reqMktData(contract, 'mdoff,233', False, False)
-                ib.sleep(2)  # Wait for the snapshot
-                
-                # Check the data
-                st.session_state.ticker_data = {
-                    'Contract': str(ticker.contract),
-                    'Last': ticker.last,
-                    'Bid': ticker.bid, 
-                    'Ask': ticker.ask,
-                    'Volume': ticker.volume,
+                t.updateEvent += _first_tick
+                try:
+                    await asyncio.wait_for(fut, timeout=10)
+                except asyncio.TimeoutError:
+                    return None
+                finally:
+                    t.updateEvent -= _first_tick
+                    t.updateEvent -= on_ticker_update
+                return st.session_state.ticker_data
+            
+            async def manual_snapshot_method():
+                t = ib.reqMktData(stock, 'mdoff,233', False, False)
+                await asyncio.sleep(2)
+                if t.last is None and t.bid is None and t.ask is None:
+                    return None
+                return {
+                    'Contract': str(t.contract),
+                    'Last': t.last,
+                    'Bid': t.bid,
+                    'Ask': t.ask,
+                    'Volume': t.volume,
+                    'Has Data': True,
                     'Method': 'Market Snapshot'
                 }
+            
+            async def race_methods():
+                tasks = {asyncio.ensure_future(m()) for m in
+                         (snapshot_method, streaming_method, manual_snapshot_method)}
+                result = None
+                try:
+                    # Keep waiting as methods finish until one yields data
+                    while tasks and result is None:
+                        done, tasks = await asyncio.wait(
+                            tasks, return_when=asyncio.FIRST_COMPLETED)
+                        for t in done:
+                            data = t.result()
+                            if data and data.get('Has Data'):
+                                result = data
+                                break
+                finally:
+                    for t in tasks:
+                        t.cancel()
+                return result
+            
+            st.text("Racing snapshot, streaming and manual snapshot methods...")
+            # Spinner animates client-side, so the wait emits no
+            # websocket frames - unlike incremental progress updates
+            with st.spinner("Waiting for market data..."):
+                result = ib.run(race_methods())
+            
+            if result:
+                st.session_state.ticker_data = result
+            ticker = ib.ticker(stock)  # for the diagnostics expander below
+            
+            if st.session_state.ticker_data:
                 data_display.json(st.session_state.ticker_data)
+            else:
+                data_display.text("No ticker data received")
             
             # Final check
             has_data = False
@@ -243,23 +269,26 @@ if st.button("Connect to IB Gateway"):
                 else:
                     st.warning("Could not get valid price data through normal means")
             
-            # Show some API diagnostic info
+            # Show some API diagnostic info. The probing is gated behind a
+            # checkbox so a collapsed expander costs nothing per rerun -
+            # expander contents are still evaluated even when collapsed.
             with st.expander("API Diagnostic Info"):
-                # Check API connectivity
-                managed_accounts = ib.client.getAccounts()
-                st.text(f"Connected accounts: {managed_accounts}")
-                
-                # Check market data permissions
-                st.text("Checking market data permissions...")
-                try:
-                    permissions = ib.reqMarketDataType(3)  # Request delayed data
-                    st.text(f"Market data type set to: 3 (Delayed)")
+                if st.checkbox("Run diagnostics"):
+                    # Check API connectivity
+                    managed_accounts = ib.client.getAccounts()
+                    st.text(f"Connected accounts: {managed_accounts}")
                     
-                    # Try to check permissions directly
-                    snapshot_permissions = ticker.snapshotPermissions if hasattr(ticker, 'snapshotPermissions') else "Unknown"
-                    st.text(f"Snapshot permissions: {snapshot_permissions}")
-                except Exception as e:
-                    st.text(f"Error checking permissions: {e}")
+                    # Check market data permissions
+                    st.text("Checking market data permissions...")
+                    try:
+                        permissions = ib.reqMarketDataType(3)  # Request delayed data
+                        st.text(f"Market data type set to: 3 (Delayed)")
+                        
+                        # Try to check permissions directly
+                        snapshot_permissions = ticker.snapshotPermissions  # always present on Ticker
+                        st.text(f"Snapshot permissions: {snapshot_permissions}")
+                    except Exception as e:
+                        st.text(f"Error checking permissions: {e}")
                     
                 # Show TWS settings that might be relevant
                 st.text("\nTWS Settings to Check:")
@@ -276,12 +305,16 @@ if st.button("Connect to IB Gateway"):
                 
         except Exception as e:
             st.error(f"Error testing market data: {e}")
-            import traceback
-            st.text(traceback.format_exc())
+            # format_exc walks and renders every frame - only pay for it
+            # (and the multi-KB websocket push) when debugging
+            if st.session_state.get('debug'):
+                import traceback
+                st.text(traceback.format_exc())
                 
         # Option to disconnect
         if st.button("Disconnect"):
             ib.disconnect()
+            get_ib.clear()  # drop the cached connection so Connect rebuilds it
             st.session_state.pop('ib', None)
             st.success("Disconnected from IB Gateway")
             st.experimental_rerun()
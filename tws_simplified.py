@@ -7,51 +7,35 @@ import pandas as pd
 import numpy as np
 import time
 import locale
+import pickle
+import re
 import random
+from collections import deque
 from datetime import datetime
 import asyncio
-import nest_asyncio
 import sys
 import os
 
 # Set locale for proper currency formatting
 locale.setlocale(locale.LC_ALL, '')
 
-# Fix asyncio event loop for Streamlit
-# First set the event loop policy
-asyncio.set_event_loop_policy(asyncio.DefaultEventLoopPolicy())
-
-# Create new event loop and set as default
-try:
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
-except Exception as e:
-    st.error(f"Error setting up event loop: {e}")
-
-# Apply nest_asyncio to allow nested use of asyncio event loops
-try:
-    nest_asyncio.apply()
-except Exception as e:
-    st.error(f"Error applying nest_asyncio: {e}")
-
-# Define helper function for ensuring event loop
-def setup_asyncio_event_loop():
-    """Ensure there is an event loop available for the current thread"""
-    try:
-        loop = asyncio.get_event_loop()
-    except RuntimeError:
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-    return loop
+# One persistent event loop for the whole process. nest_asyncio's
+# re-entrant patching added overhead to every await and is a known
+# source of re-entrancy bugs under Streamlit; ib_insync's own ib.run()
+# and ib.sleep() pump this loop directly, so no nesting is needed.
+@st.cache_resource
+def get_loop():
+    return asyncio.new_event_loop()
 
-# Set up event loop before importing ib_insync
-setup_asyncio_event_loop()
+# Set up event loop before importing ib_insync. Reruns execute on fresh
+# script threads, so the shared loop must be re-installed on each run -
+# setting it only inside the cached factory covers the first run alone.
+loop = get_loop()
+asyncio.set_event_loop(loop)
 
 # Now import ib_insync
 try:
     from ib_insync import *
-    # Fixed: Remove the qtapp parameter as it's not supported in your version
-    util.useQt()  # This will help with Qt integration if needed
 except Exception as e:
     st.error(f"Error importing ib_insync: {e}")
     st.stop()
@@ -63,24 +47,42 @@ st.set_page_config(
     layout="wide"
 )
 
+# The locale tables don't change after startup; read the currency
+# symbol once and fold it into a single compiled strip pattern rather
+# than calling locale.localeconv() (which allocates a dict) per value
+_STRIP_RE = re.compile(r'[,\s' + re.escape(locale.localeconv()['currency_symbol']) + r']')
+
 # Helper function for safe float conversion
 def safe_float_conversion(value_str):
-    if value_str is None:
-        return 0.0
-    
-    if isinstance(value_str, str):
-        clean_str = value_str.replace(locale.localeconv()['currency_symbol'], '')
-        clean_str = clean_str.replace(',', '')
-        try:
-            return float(clean_str)
-        except ValueError:
-            return 0.0
-    
     try:
-        return float(value_str)
+        if isinstance(value_str, str):
+            return float(_STRIP_RE.sub('', value_str) or 0)
+        return float(value_str or 0)
     except (ValueError, TypeError):
         return 0.0
 
+# Token-bucket throttle for outbound requests: admit up to 45 messages
+# per rolling second (TWS caps at 50) instead of pacing with fixed
+# sleeps, so full rate headroom is used and the backoff only happens
+# when the budget is actually exhausted
+class RateLimiter:
+    def __init__(self, rate=45, period=1.0):
+        self.rate = rate
+        self.period = period
+        self._stamps = deque()
+    
+    def throttle(self, n=1):
+        now = time.monotonic()
+        while self._stamps and now - self._stamps[0] > self.period:
+            self._stamps.popleft()
+        if len(self._stamps) + n > self.rate and self._stamps:
+            wait = self.period - (now - self._stamps[0])
+            if wait > 0:
+                ib.sleep(wait)  # pumps the loop while backing off
+        self._stamps.extend([time.monotonic()] * n)
+
+_rate = RateLimiter()
+
 # Initialize IB connection
 @st.cache_resource
 def get_ib():
@@ -116,343 +118,452 @@ def connect_to_tws():
             return False
     return True
 
-# Get portfolio data (synchronous version)
-def get_portfolio_data():
+# Disk-backed snapshot cache: within a minute bucket a rerun loads
+# parquet in milliseconds instead of re-pulling everything from TWS,
+# and snapshots survive Streamlit process restarts
+_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.portfolio_cache')
+
+def _snapshot_paths(account, bucket):
+    base = os.path.join(_CACHE_DIR, f"{account}_{bucket}")
+    return base + '_account.parquet', base + '_underlying.parquet', base + '_positions.pkl'
+
+# Errors raise out of the cached body so cache_data never stores a
+# failure - a fetch before connecting (or one transient TWS error) must
+# not pin (None, None, None) for the rest of the minute bucket
+@st.cache_data(ttl=60, show_spinner=False)
+def _cached_portfolio_data(minute_bucket):
+    accounts = ib.managedAccounts()
+    account = accounts[0] if accounts else 'default'
+    acct_path, und_path, pos_path = _snapshot_paths(account, minute_bucket)
+
+    if os.path.exists(pos_path):
+        try:
+            with open(pos_path, 'rb') as f:
+                positions_by_underlying = pickle.load(f)
+            return pd.read_parquet(acct_path), pd.read_parquet(und_path), positions_by_underlying
+        except Exception:
+            pass  # corrupt or partial snapshot - fall through to a live fetch
+
+    account_df, underlying_df, positions_by_underlying = _fetch_portfolio_data()
+
+    try:
+        os.makedirs(_CACHE_DIR, exist_ok=True)
+        account_df.to_parquet(acct_path)
+        underlying_df.to_parquet(und_path)
+        with open(pos_path, 'wb') as f:
+            pickle.dump(positions_by_underlying, f)
+        # Drop this account's snapshots from earlier minute buckets -
+        # only the current bucket is ever read again, so without
+        # pruning the directory grows by three files a minute forever
+        prefix = f"{account}_"
+        keep = f"{account}_{minute_bucket}"
+        for name in os.listdir(_CACHE_DIR):
+            if name.startswith(prefix) and not name.startswith(keep):
+                try:
+                    os.remove(os.path.join(_CACHE_DIR, name))
+                except OSError:
+                    pass
+    except Exception as e:
+        st.warning(f"Could not persist portfolio snapshot: {e}")
+
+    return account_df, underlying_df, positions_by_underlying
+
+# Uncached wrapper: the connection check and error display stay outside
+# the cache so only successful fetches are memoized
+def get_portfolio_data(minute_bucket):
     if not ib.isConnected():
         st.error("Not connected to TWS")
         return None, None, None
-    
+
     try:
-        st.info("Requesting account summary...")
-        account_summary = ib.accountSummary()
-        
-        if not account_summary:
-            st.warning("Account summary is empty")
-            return None, None, None
-            
-        st.success(f"Got {len(account_summary)} account values")
-        
-        account_df = pd.DataFrame([(row.tag, row.value) for row in account_summary], 
-                            columns=['Tag', 'Value'])
-        account_df = account_df.set_index('Tag')
-        
-        st.info("Requesting positions...")
-        positions = ib.positions()
-        
-        if not positions:
-            st.warning("No positions found")
-            return account_df, pd.DataFrame(), {}
-            
-        st.success(f"Got {len(positions)} positions")
-        
-        # Create a dictionary to store positions by underlying
-        positions_by_underlying = {}
+        return _cached_portfolio_data(minute_bucket)
+    except Exception as e:
+        st.error(f"Error in portfolio data retrieval: {e}")
+        import traceback
+        st.text(traceback.format_exc())
+        return None, None, None
+
+# Get portfolio data (synchronous version); raises on failure
+def _fetch_portfolio_data():
+    # One status container absorbs all the step-by-step chatter;
+    # each update rewrites a single frontend element instead of
+    # appending a new one per message
+    status = st.status("Fetching portfolio data...", expanded=False)
+    account_summary = ib.accountSummary()
+
+    if not account_summary:
+        status.update(label="Account summary is empty", state="error")
+        raise ValueError("Account summary is empty")
+
+    status.update(label=f"Got {len(account_summary)} account values, requesting positions...")
+    
+    account_df = pd.DataFrame([(row.tag, row.value) for row in account_summary], 
+                        columns=['Tag', 'Value'])
+    account_df = account_df.set_index('Tag')
+    
+    positions = ib.positions()
+    
+    if not positions:
+        status.update(label="No positions found", state="complete")
+        return account_df, pd.DataFrame(), {}
+    
+    # Create a dictionary to store positions by underlying
+    positions_by_underlying = {}
+    
+    # Two passes: issue every market data request up front, then wait
+    # once for the whole batch to populate. The previous per-contract
+    # request + 0.2s sleep serialized the idle time; one aggregate
+    # window covers all tickers at the same time.
+    status.update(label=f"Requesting market data for {len(positions)} positions...")
+    
+    underlying_contracts = {}
+    option_contracts = []
+    for pos in positions:
+        contract = pos.contract
+        if contract.secType == 'STK':
+            underlying_contracts.setdefault(contract.symbol, contract)
+        else:
+            # For options, price the underlying as well, reusing the
+            # session-cached qualified contract per symbol
+            if contract.symbol not in underlying_contracts:
+                underlying_contracts[contract.symbol] = _qualify_stock(contract.symbol)
+            if contract.secType == 'OPT':
+                option_contracts.append(contract)
+    
+    # Qualify whatever is still unqualified in one variadic call
+    unqualified = [c for c in underlying_contracts.values() if not c.conId]
+    if unqualified:
+        ib.qualifyContracts(*unqualified)
+    
+    # reqTickers snapshots every contract concurrently and returns
+    # once each ticker is populated - no aggregate sleep to tune
+    all_contracts = list(underlying_contracts.values()) + option_contracts
+    _rate.throttle(len(all_contracts))
+    tickers = {c.conId: t for c, t in zip(all_contracts, ib.reqTickers(*all_contracts))}
+    
+    def best_price(ticker):
+        price = ticker.marketPrice()
+        if price is None or price <= 0:
+            price = ticker.last
+        if price is None or price <= 0:
+            price = (ticker.ask + ticker.bid) / 2 if ticker.ask and ticker.bid else None
+        return price
+    
+    # Process positions
+    progress = status.progress(0.0)
+    position_count = 0
+    underlying_price_cache = {}
+    opt_symbols, opt_positions, opt_deltas, opt_prices = [], [], [], []
+    
+    for pos in positions:
+        position_count += 1
+        contract = pos.contract
+        underlying_symbol = contract.symbol
         
-        # Process positions
-        st.info("Processing positions...")
-        position_count = 0
+        # Resolve each underlying's price once per fetch - multiple
+        # option legs on the same symbol share the lookup
+        underlying_price = underlying_price_cache.get(underlying_symbol)
+        if underlying_price is None:
+            underlying_price = best_price(tickers[underlying_contracts[underlying_symbol].conId])
+            if underlying_price is not None and underlying_price > 0:
+                underlying_price_cache[underlying_symbol] = underlying_price
         
-        for pos in positions:
-            position_count += 1
-            contract = pos.contract
-            underlying_symbol = contract.symbol
-            
-            # Get market price for the underlying
+        # Handle None or 0 prices
+        if underlying_price is None or underlying_price <= 0:
             if contract.secType == 'STK':
-                underlying_contract = contract
+                underlying_price = pos.avgCost
+                st.warning(f"No market price for {underlying_symbol}, using avg cost: {underlying_price}")
             else:
-                # For options, get the underlying price
-                underlying_contract = Stock(underlying_symbol, 'SMART', 'USD')
-                ib.qualifyContracts(underlying_contract)
-            
-            # Use ticker to get real-time price updates
-            ticker = ib.reqMktData(underlying_contract)
-            time.sleep(0.2)  # Small delay to respect rate limits
-            underlying_price = ticker.marketPrice()
-            
-            # Handle None or 0 prices
-            if underlying_price is None or underlying_price <= 0:
-                underlying_price = ticker.last
-                if underlying_price is None or underlying_price <= 0:
-                    underlying_price = (ticker.ask + ticker.bid) / 2 if ticker.ask and ticker.bid else None
-                    if underlying_price is None or underlying_price <= 0:
-                        if contract.secType == 'STK':
-                            underlying_price = pos.avgCost
-                            st.warning(f"No market price for {underlying_symbol}, using avg cost: {underlying_price}")
-                        else:
-                            st.warning(f"No price data for {underlying_symbol}, using 100 as placeholder")
-                            underlying_price = 100  # Arbitrary placeholder
-            
-            st.text(f"Position {position_count}: {underlying_symbol} @ {underlying_price}")
-            
-            if underlying_symbol not in positions_by_underlying:
-                positions_by_underlying[underlying_symbol] = {
-                    'stock_count': 0,
-                    'stock_value': 0,
-                    'option_notional': 0,
-                    'option_actual_value': 0,
-                    'underlying_price': underlying_price
-                }
-            
-            # Calculate position values
-            if contract.secType == 'STK':
-                positions_by_underlying[underlying_symbol]['stock_count'] += pos.position
-                positions_by_underlying[underlying_symbol]['stock_value'] += pos.position * underlying_price
-            elif contract.secType == 'OPT':
-                # Get option data
-                option_ticker = ib.reqMktData(contract)
-                time.sleep(0.2)  # Small delay to respect rate limits
-                
-                # Calculate option delta (if available, otherwise use approximation)
-                delta = None
-                option_price = option_ticker.marketPrice()
-                
-                if hasattr(option_ticker, 'modelGreeks') and option_ticker.modelGreeks:
-                    delta = option_ticker.modelGreeks.delta
-                else:
-                    # Request option computation
-                    ib.reqMarketDataType(4)  # Switch to delayed frozen data
-                    try:
-                        ib.calculateImpliedVolatility(contract, option_price, underlying_price)
-                        time.sleep(0.2)
-                        ib.calculateOptionPrice(contract, option_ticker.impliedVolatility, underlying_price)
-                        time.sleep(0.2)
-                        
-                        # Try again to get delta
-                        if hasattr(option_ticker, 'modelGreeks') and option_ticker.modelGreeks:
-                            delta = option_ticker.modelGreeks.delta
-                    except Exception as option_error:
-                        st.warning(f"Option calculation error: {option_error}")
-                    
-                    # Fallback delta calculation if still None
-                    if delta is None:
-                        if contract.right == 'C':  # Call option
-                            delta = 0.7 if underlying_price > contract.strike else 0.3
-                        else:  # Put option
-                            delta = -0.7 if underlying_price < contract.strike else -0.3
-                
-                # Use absolute value of delta for notional calculation
-                abs_delta = abs(delta)
-                option_multiplier = 100
-                option_notional = abs_delta * option_multiplier * pos.position
-                positions_by_underlying[underlying_symbol]['option_notional'] += option_notional
-                
-                # Calculate actual option value
-                option_value = option_price * option_multiplier * abs(pos.position)
-                positions_by_underlying[underlying_symbol]['option_actual_value'] += option_value
+                st.warning(f"No price data for {underlying_symbol}, using 100 as placeholder")
+                underlying_price = 100  # Arbitrary placeholder
         
-        st.info("Creating dataframe...")
+        progress.progress(position_count / len(positions))
         
-        # Create DataFrame for display
-        underlying_data = []
-        total_npv = 0
+        if underlying_symbol not in positions_by_underlying:
+            positions_by_underlying[underlying_symbol] = {
+                'stock_count': 0,
+                'stock_value': 0,
+                'option_notional': 0,
+                'option_actual_value': 0,
+                'underlying_price': underlying_price
+            }
         
-        for symbol, data in positions_by_underlying.items():
-            stock_notional = data['stock_count'] * data['underlying_price']
-            option_notional = data['option_notional'] * data['underlying_price']
-            total_notional = stock_notional + option_notional
-            
-            underlying_data.append({
-                'Symbol': symbol,
-                'Stock Count': data['stock_count'],
-                'Stock Value': data['stock_value'],
-                'Option Notional (Shares)': data['option_notional'] / 100,  # Convert to contract equivalents
-                'Option Notional Value': option_notional,
-                'Option Actual Value': data['option_actual_value'],
-                'Underlying Price': data['underlying_price'],
-                'Notional Position Value (NPV)': total_notional
-            })
-            
-            total_npv += total_notional
-        
-        underlying_df = pd.DataFrame(underlying_data)
-        st.success(f"Created dataframe with {len(underlying_df)} rows")
+        # Calculate position values
+        if contract.secType == 'STK':
+            positions_by_underlying[underlying_symbol]['stock_count'] += pos.position
+            positions_by_underlying[underlying_symbol]['stock_value'] += pos.position * underlying_price
+        elif contract.secType == 'OPT':
+            option_ticker = tickers[contract.conId]
+            
+            # Use delivered greeks, falling back to a moneyness
+            # approximation when none arrived in the batch window
+            if option_ticker.modelGreeks:
+                delta = option_ticker.modelGreeks.delta
+            elif contract.right == 'C':  # Call option
+                delta = 0.7 if underlying_price > contract.strike else 0.3
+            else:  # Put option
+                delta = -0.7 if underlying_price < contract.strike else -0.3
+            
+            # Defer the notional math: collect the raw legs and run
+            # the arithmetic as one vectorized pass after the loop
+            opt_symbols.append(underlying_symbol)
+            opt_positions.append(pos.position)
+            opt_deltas.append(delta)
+            opt_prices.append(option_ticker.marketPrice())
+    
+    # Option notional/value math in one C-loop over all legs
+    if opt_symbols:
+        option_multiplier = 100
+        pos_arr = np.asarray(opt_positions, dtype=np.float64)
+        notional_arr = np.abs(np.asarray(opt_deltas, dtype=np.float64)) * option_multiplier * pos_arr
+        value_arr = np.asarray(opt_prices, dtype=np.float64) * option_multiplier * np.abs(pos_arr)
+        opt_totals = pd.DataFrame({'symbol': opt_symbols,
+                                   'notional': notional_arr,
+                                   'value': value_arr}).groupby('symbol', sort=False).sum()
+        for symbol, row in opt_totals.iterrows():
+            positions_by_underlying[symbol]['option_notional'] = row['notional']
+            positions_by_underlying[symbol]['option_actual_value'] = row['value']
+    
+    status.update(label="Aggregating positions...")
+    
+    # Vectorized aggregation: lift the accumulated per-underlying
+    # dicts into one frame and compute the notional columns as array
+    # operations instead of a Python row-building loop
+    agg = pd.DataFrame.from_dict(positions_by_underlying, orient='index')
+    option_notional = agg['option_notional'] * agg['underlying_price']
+    total_notional = agg['stock_count'] * agg['underlying_price'] + option_notional
+    
+    underlying_df = pd.DataFrame({
+        'Symbol': agg.index.to_numpy(),
+        'Stock Count': agg['stock_count'].to_numpy(),
+        'Stock Value': agg['stock_value'].to_numpy(),
+        'Option Notional (Shares)': (agg['option_notional'] / 100).to_numpy(),  # contract equivalents
+        'Option Notional Value': option_notional.to_numpy(),
+        'Option Actual Value': agg['option_actual_value'].to_numpy(),
+        'Underlying Price': agg['underlying_price'].to_numpy(),
+        'Notional Position Value (NPV)': total_notional.to_numpy()
+    })
+    total_npv = float(total_notional.sum())
+    # Calculate portfolio metrics
+    try:
+        nlv = safe_float_conversion(account_df.loc['NetLiquidation', 'Value'])
+        gross_pos_val = safe_float_conversion(account_df.loc['GrossPositionValue', 'Value'])
         
-        # Calculate portfolio metrics
-        st.info("Calculating metrics...")
-        try:
-            nlv = safe_float_conversion(account_df.loc['NetLiquidation', 'Value'])
-            gross_pos_val = safe_float_conversion(account_df.loc['GrossPositionValue', 'Value'])
-            
-            # Calculate notional leverage ratio
-            notional_leverage_ratio = total_npv / nlv if nlv > 0 else 0
-            standard_leverage_ratio = gross_pos_val / nlv if nlv > 0 else 0
-            
-            # Add NGAV and NLR to account summary
-            account_df.loc['NGAV (Notional Gross Asset Value)', 'Value'] = locale.currency(total_npv, grouping=True)
-            account_df.loc['NLR (Notional Leverage Ratio)', 'Value'] = f"{notional_leverage_ratio:.2f}"
-            account_df.loc['Standard Leverage Ratio', 'Value'] = f"{standard_leverage_ratio:.2f}"
-            
-            st.success("Metrics calculated successfully")
-        except Exception as metrics_error:
-            st.error(f"Error calculating metrics: {metrics_error}")
-            # Handle case where account data doesn't have the expected fields
-            pass
+        # Calculate notional leverage ratio
+        notional_leverage_ratio = total_npv / nlv if nlv > 0 else 0
+        standard_leverage_ratio = gross_pos_val / nlv if nlv > 0 else 0
         
-        st.success("Portfolio data retrieval complete")
-        return account_df, underlying_df, positions_by_underlying
+        # Add NGAV and NLR to account summary
+        account_df.loc['NGAV (Notional Gross Asset Value)', 'Value'] = locale.currency(total_npv, grouping=True)
+        account_df.loc['NLR (Notional Leverage Ratio)', 'Value'] = f"{notional_leverage_ratio:.2f}"
+        account_df.loc['Standard Leverage Ratio', 'Value'] = f"{standard_leverage_ratio:.2f}"
         
-    except Exception as e:
-        st.error(f"Error in portfolio data retrieval: {str(e)}")
-        import traceback
-        st.text(traceback.format_exc())
-        return None, None, None
+    except Exception as metrics_error:
+        st.error(f"Error calculating metrics: {metrics_error}")
+        # Handle case where account data doesn't have the expected fields
+        pass
+    
+    status.update(label=f"Portfolio data retrieval complete ({len(underlying_df)} underlyings)",
+                  state="complete")
+    return account_df, underlying_df, positions_by_underlying
+
+# Qualified contracts don't change within a session; cache them so a
+# repeat lookup of the same symbol skips the qualification round-trip
+@st.cache_resource
+def _qualify_stock(symbol):
+    stock = Stock(symbol, 'SMART', 'USD')
+    ib.qualifyContracts(stock)
+    return stock
+
+# Chain definitions (expirations/strikes) change rarely intraday
+@st.cache_data(ttl=3600)
+def _get_chains(symbol, conId, secType):
+    return ib.reqSecDefOptParams(symbol, '', secType, conId)
+
+# Derived per-strike columns as one vectorized kernel - numpy runs the
+# arithmetic as C loops over the whole strike window at once
+def _option_row_math(strikes, stock_price, call_prices, put_prices):
+    if stock_price and stock_price > 0:
+        call_pct = call_prices / stock_price * 100
+        put_pct = put_prices / stock_price * 100
+        call_diff = np.where(stock_price > strikes, call_prices - (stock_price - strikes), call_prices)
+        put_diff = np.where(stock_price < strikes, put_prices - (strikes - stock_price), put_prices)
+    else:
+        call_pct = np.zeros_like(call_prices)
+        put_pct = np.zeros_like(put_prices)
+        call_diff = call_prices
+        put_diff = put_prices
+    return call_pct, put_pct, call_diff, put_diff
+
+# Get option chain for a ticker. Cached so re-exploring the same symbol
+# within five minutes is served from memory instead of TWS. Errors raise
+# out of the cached body so cache_data never stores a failure - a click
+# before connecting (or one transient TWS hiccup) must not pin None for
+# the whole TTL.
+@st.cache_data(ttl=300, show_spinner=False)
+def _fetch_option_chain(ticker):
+    # Get the stock contract
+    stock = _qualify_stock(ticker)
+
+    # Get current stock price
+    (ticker_data,) = ib.reqTickers(stock)
+    stock_price = ticker_data.marketPrice()
+
+    # Get the option chains
+    chains = _get_chains(stock.symbol, stock.conId, stock.secType)
 
-# Get option chain for a ticker
+    # Get all expiration dates
+    expirations = []
+    for chain in chains:
+        if chain.exchange == 'SMART':
+            expirations = sorted(chain.expirations)
+            break
+
+    return stock_price, expirations
+
+# Uncached wrapper: connection checks and error display stay outside the
+# cache so only successful fetches are memoized
 def get_option_chain(ticker):
     if not ib.isConnected():
         st.error("Not connected to TWS")
         return None, None
-    
+
     try:
-        # Get the stock contract
-        stock = Stock(ticker, 'SMART', 'USD')
-        ib.qualifyContracts(stock)
-        
-        # Get current stock price
-        ticker_data = ib.reqMktData(stock)
-        time.sleep(0.5)  # Give it a bit more time
-        stock_price = ticker_data.marketPrice()
-        
-        # Get the option chains
-        chains = ib.reqSecDefOptParams(stock.symbol, '', stock.secType, stock.conId)
-        
-        # Get all expiration dates
-        expirations = []
-        for chain in chains:
-            if chain.exchange == 'SMART':
-                expirations = sorted(chain.expirations)
-                break
-        
-        return stock_price, expirations
+        return _fetch_option_chain(ticker)
     except Exception as e:
         st.error(f"Error getting option chain: {e}")
         return None, None
 
-# Get options for a specific expiration
+# Get options for a specific expiration, cached by (ticker, expiration)
+@st.cache_data(ttl=300, show_spinner=False)
+def _fetch_options_for_expiration(ticker, expiration):
+    # Get the stock contract
+    stock = _qualify_stock(ticker)
+
+    # Get current stock price
+    (ticker_data,) = ib.reqTickers(stock)
+    stock_price = ticker_data.marketPrice()
+
+    # Get option chain for selected expiration
+    chains = _get_chains(stock.symbol, stock.conId, stock.secType)
+
+    # Find the SMART exchange chain
+    chain = next((c for c in chains if c.exchange == 'SMART'), None)
+    if not chain:
+        raise ValueError("No SMART exchange option chain found")
+
+    # Limit the number of strikes to avoid overloading: pick the
+    # strikes nearest the money in one vectorized pass. argpartition
+    # is O(n) versus sorting the whole ladder just to slice it.
+    max_strikes = 10  # Adjust this as needed
+    strikes_arr = np.asarray(list(chain.strikes), dtype=np.float64)
+    if len(strikes_arr) > max_strikes:
+        idx = np.argpartition(np.abs(strikes_arr - stock_price), max_strikes)[:max_strikes]
+        limited_strikes = np.sort(strikes_arr[idx])
+    else:
+        limited_strikes = np.sort(strikes_arr)
+    st.info(f"Fetching data for {len(limited_strikes)} strikes around current price")
+    
+    # Build every contract up front, qualify them in one variadic
+    # call and snapshot them together - reqTickers issues the
+    # requests concurrently and returns only when each ticker is
+    # populated, so there is no per-strike delay to tune
+    contracts = []
+    for strike in limited_strikes:
+        contracts.append(Option(ticker, expiration, strike, 'C', 'SMART'))
+        contracts.append(Option(ticker, expiration, strike, 'P', 'SMART'))
+    
+    ib.qualifyContracts(*contracts)
+    _rate.throttle(len(contracts))
+    option_tickers = ib.reqTickers(*contracts)
+    call_tickers = option_tickers[0::2]
+    put_tickers = option_tickers[1::2]
+    
+    # Harvest prices once, then run the pct/diff math over the whole
+    # window in a single kernel call instead of per-strike Python
+    call_prices = np.array([t.marketPrice() for t in call_tickers], dtype=np.float64)
+    put_prices = np.array([t.marketPrice() for t in put_tickers], dtype=np.float64)
+    call_pcts, put_pcts, call_diffs, put_diffs = _option_row_math(
+        limited_strikes, stock_price, call_prices, put_prices)
+    
+    # Preallocate one typed array per column (SoA) and fill by
+    # index; the frames are then built in one shot from the arrays
+    # with no per-row dicts to allocate or re-parse
+    n = len(limited_strikes)
+    call_bid = np.empty(n)
+    call_ask = np.empty(n)
+    call_last = np.empty(n)
+    call_delta = np.empty(n)
+    call_gamma = np.empty(n)
+    put_bid = np.empty(n)
+    put_ask = np.empty(n)
+    put_last = np.empty(n)
+    put_delta = np.empty(n)
+    put_gamma = np.empty(n)
+    
+    for i, (strike, call_ticker, put_ticker) in enumerate(zip(limited_strikes,
+                                                              call_tickers,
+                                                              put_tickers)):
+        call_bid[i] = call_ticker.bid
+        call_ask[i] = call_ticker.ask
+        call_last[i] = call_ticker.last
+        
+        # Delivered greeks, or the moneyness approximation
+        greeks = call_ticker.modelGreeks
+        if greeks and greeks.delta is not None:
+            call_delta[i] = greeks.delta
+            call_gamma[i] = greeks.gamma if greeks.gamma is not None else 0.01
+        else:
+            call_delta[i] = 0.7 if stock_price > strike else 0.3
+            call_gamma[i] = 0.01  # Default gamma
+        
+        put_bid[i] = put_ticker.bid
+        put_ask[i] = put_ticker.ask
+        put_last[i] = put_ticker.last
+        
+        greeks = put_ticker.modelGreeks
+        if greeks and greeks.delta is not None:
+            put_delta[i] = greeks.delta
+            put_gamma[i] = greeks.gamma if greeks.gamma is not None else 0.01
+        else:
+            put_delta[i] = -0.7 if stock_price < strike else -0.3
+            put_gamma[i] = 0.01  # Default gamma
+    
+    calls_df = pd.DataFrame({
+        'Strike': limited_strikes,
+        'Bid': call_bid,
+        'Ask': call_ask,
+        'Last': call_last,
+        'Price': call_prices,
+        'Delta': call_delta,
+        'Gamma': call_gamma,
+        'Pct of Stock': np.char.mod('%.2f%%', call_pcts),
+        'Diff from Stock': call_diffs
+    })
+    
+    puts_df = pd.DataFrame({
+        'Strike': limited_strikes,
+        'Bid': put_bid,
+        'Ask': put_ask,
+        'Last': put_last,
+        'Price': put_prices,
+        'Delta': put_delta,
+        'Gamma': put_gamma,
+        'Pct of Stock': np.char.mod('%.2f%%', put_pcts),
+        'Diff from Stock': put_diffs
+    })
+    
+    return stock_price, calls_df, puts_df
+
+# Uncached wrapper mirroring get_option_chain: guard and error display
+# outside the cache so failures are never memoized
 def get_options_for_expiration(ticker, expiration):
     if not ib.isConnected():
         st.error("Not connected to TWS")
         return None, None, None
-    
+
     try:
-        # Get the stock contract
-        stock = Stock(ticker, 'SMART', 'USD')
-        ib.qualifyContracts(stock)
-        
-        # Get current stock price
-        ticker_data = ib.reqMktData(stock)
-        time.sleep(0.5)
-        stock_price = ticker_data.marketPrice()
-        
-        # Get option chain for selected expiration
-        chains = ib.reqSecDefOptParams(stock.symbol, '', stock.secType, stock.conId)
-        
-        # Find the SMART exchange chain
-        chain = next((c for c in chains if c.exchange == 'SMART'), None)
-        if not chain:
-            st.warning("No SMART exchange option chain found")
-            return None, None, None
-        
-        # Get all strike prices
-        strikes = sorted(chain.strikes)
-        
-        # Create call and put options
-        calls = []
-        puts = []
-        
-        # Limit the number of strikes to avoid overloading
-        max_strikes = 10  # Adjust this as needed
-        middle_index = next((i for i, s in enumerate(strikes) if s >= stock_price), len(strikes)//2)
-        start_index = max(0, middle_index - max_strikes//2)
-        end_index = min(len(strikes), start_index + max_strikes)
-        
-        limited_strikes = strikes[start_index:end_index]
-        st.info(f"Fetching data for {len(limited_strikes)} strikes around current price")
-        
-        # Request data for each strike
-        for strike in limited_strikes:
-            call_contract = Option(ticker, expiration, strike, 'C', 'SMART')
-            put_contract = Option(ticker, expiration, strike, 'P', 'SMART')
-            
-            ib.qualifyContracts(call_contract, put_contract)
-            
-            # Request market data for call
-            call_ticker = ib.reqMktData(call_contract)
-            time.sleep(0.1)  # Small delay to respect rate limits
-            
-            # Request market data for put
-            put_ticker = ib.reqMktData(put_contract)
-            time.sleep(0.1)  # Small delay
-            
-            # Get data for call
-            call_price = call_ticker.marketPrice()
-            call_bid = call_ticker.bid
-            call_ask = call_ticker.ask
-            call_last = call_ticker.last
-            
-            # Try to get delta and gamma for call
-            call_delta = None
-            call_gamma = None
-            
-            if hasattr(call_ticker, 'modelGreeks') and call_ticker.modelGreeks:
-                call_delta = call_ticker.modelGreeks.delta
-                call_gamma = call_ticker.modelGreeks.gamma
-            else:
-                # Use approximation
-                call_delta = 0.7 if stock_price > strike else 0.3
-                call_gamma = 0.01  # Default gamma
-            
-            # Similarly for put
-            put_price = put_ticker.marketPrice()
-            put_bid = put_ticker.bid
-            put_ask = put_ticker.ask
-            put_last = put_ticker.last
-            
-            put_delta = None
-            put_gamma = None
-            
-            if hasattr(put_ticker, 'modelGreeks') and put_ticker.modelGreeks:
-                put_delta = put_ticker.modelGreeks.delta
-                put_gamma = put_ticker.modelGreeks.gamma
-            else:
-                # Use approximation
-                put_delta = -0.7 if stock_price < strike else -0.3
-                put_gamma = 0.01  # Default gamma
-            
-            # Calculate percentage of stock price
-            call_pct = (call_price / stock_price) * 100 if stock_price and stock_price > 0 else 0
-            put_pct = (put_price / stock_price) * 100 if stock_price and stock_price > 0 else 0
-            
-            # Calculate difference from stock price
-            call_diff = call_price - (stock_price - strike) if stock_price and stock_price > strike else call_price
-            put_diff = put_price - (strike - stock_price) if stock_price and stock_price < strike else put_price
-            
-            calls.append({
-                'Strike': strike,
-                'Bid': call_bid,
-                'Ask': call_ask,
-                'Last': call_last,
-                'Price': call_price,
-                'Delta': call_delta,
-                'Gamma': call_gamma,
-                'Pct of Stock': f"{call_pct:.2f}%",
-                'Diff from Stock': call_diff
-            })
-            
-            puts.append({
-                'Strike': strike,
-                'Bid': put_bid,
-                'Ask': put_ask,
-                'Last': put_last,
-                'Price': put_price,
-                'Delta': put_delta,
-                'Gamma': put_gamma,
-                'Pct of Stock': f"{put_pct:.2f}%",
-                'Diff from Stock': put_diff
-            })
-        
-        return stock_price, calls, puts
+        return _fetch_options_for_expiration(ticker, expiration)
     except Exception as e:
         st.error(f"Error getting options data: {e}")
         return None, None, None
@@ -483,7 +594,7 @@ with tab1:
     
     # Fetch button for portfolio data
     if st.button("Fetch Portfolio Data"):
-        account_df, underlying_df, _ = get_portfolio_data()
+        account_df, underlying_df, _ = get_portfolio_data(datetime.now().strftime('%Y%m%d%H%M'))
         
         if account_df is not None:
             # Display account summary
@@ -513,16 +624,17 @@ with tab1:
             # Display positions by underlying
             st.subheader("Positions by Underlying")
             
-            # Format monetary values
-            for col in ['Stock Value', 'Option Notional Value', 'Option Actual Value', 'Notional Position Value (NPV)']:
-                if col in underlying_df.columns:
-                    underlying_df[col] = underlying_df[col].apply(lambda x: locale.currency(x, grouping=True))
-            
-            # Format underlying price
-            if 'Underlying Price' in underlying_df.columns:
-                underlying_df['Underlying Price'] = underlying_df['Underlying Price'].apply(lambda x: f"${x:.2f}")
-            
-            st.dataframe(underlying_df, use_container_width=True)
+            # Keep the columns numeric and let the frontend render the
+            # currency format - no server-side string copies, and the
+            # values stay sortable in the grid
+            money_cols = ['Stock Value', 'Option Notional Value', 'Option Actual Value',
+                          'Notional Position Value (NPV)', 'Underlying Price']
+            st.dataframe(
+                underlying_df,
+                use_container_width=True,
+                column_config={col: st.column_config.NumberColumn(format="$%.2f")
+                               for col in money_cols if col in underlying_df.columns}
+            )
         elif underlying_df is not None:
             st.info("No position data found")
 
@@ -555,16 +667,12 @@ with tab2:
                 
                 # Fetch options for selected expiration
                 if st.button(f"Fetch {exp_dates[selected_exp_index]} Options"):
-                    stock_price, calls, puts = get_options_for_expiration(ticker_input, selected_exp)
+                    stock_price, calls_df, puts_df = get_options_for_expiration(ticker_input, selected_exp)
                     
-                    if stock_price is not None and calls and puts:
+                    if stock_price is not None and calls_df is not None and len(calls_df):
                         # Display options data
                         st.subheader(f"{ticker_input} Options - Stock Price: ${stock_price:.2f}")
                         
-                        # Create DataFrame for calls and puts
-                        calls_df = pd.DataFrame(calls)
-                        puts_df = pd.DataFrame(puts)
-                        
                         # Display tables side by side with strike in the middle
                         cols = st.columns([4, 2, 4])
                         
@@ -610,19 +718,14 @@ import atexit
 
 def cleanup():
     """Clean up resources before exit"""
+    # Only drop the TWS connection. Stopping or closing the loop here
+    # races with Streamlit's own shutdown when the loop is still running
+    # on another thread, raising "event loop is already running" errors.
     try:
         if ib.isConnected():
-            print("Disconnecting from TWS...")
             ib.disconnect()
-        print("Closing event loop...")
-        loop = asyncio.get_event_loop()
-        if loop.is_running():
-            loop.stop()
-        if not loop.is_closed():
-            loop.close()
-        print("Cleanup complete.")
-    except Exception as e:
-        print(f"Error during cleanup: {e}")
+    except Exception:
+        pass
 
 # Register cleanup function to be called on exit
 atexit.register(cleanup)
\ No newline at end of file